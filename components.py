@@ -1,7 +1,8 @@
 from fasthtml.common import *
+from urllib.parse import urlencode
 import markdown
 import re
-from handlers import extract_darts_score
+from handlers import record_darts_score
 
 
 def render_process_tab():
@@ -138,12 +139,126 @@ def render_process_tab():
                     Button("Analyze Call", type="submit", id="analyze-btn", disabled=True, style="margin-top: 12px;")
                 )
             )
+        ),
+        render_batch_card()
+    )
+
+
+def render_batch_card():
+    """Render the batch upload card: many audio files or zips, one shared qualifiers block"""
+    batch_js = """
+    function updateBatchForm() {
+        var input = document.getElementById('batch-input');
+        var btn = document.getElementById('batch-upload-btn');
+        var count = input.files ? input.files.length : 0;
+        btn.textContent = count ? count + ' file(s) selected' : 'Select Audio Files or Zip';
+        btn.classList.toggle('file-selected', count > 0);
+
+        var skipChecked = document.getElementById('batch-skip-qual').checked;
+        var qualifiers = document.getElementById('batch-qualifiers-input');
+        qualifiers.disabled = skipChecked;
+        qualifiers.style.opacity = skipChecked ? '0.5' : '1';
+
+        var qualifiersOk = skipChecked || qualifiers.value.trim().length > 0;
+        document.getElementById('batch-analyze-btn').disabled = !(count > 0 && qualifiersOk);
+    }
+    """
+
+    return Div(cls="card", style="margin-top: 24px;")(
+        Script(batch_js),
+        Div(cls="card-header")(
+            H3("Batch Upload")
+        ),
+        Div(cls="card-body")(
+            Form(
+                hx_post="/process_batch",
+                hx_target="#tab-content",
+                hx_swap="innerHTML",
+                enctype="multipart/form-data",
+                **{"hx-on::before-request": "document.getElementById('tab-content').innerHTML='<div class=\"card\"><div class=\"card-body\"><div class=\"processing-text\"><div class=\"spinner\"></div><p>Uploading files...</p></div></div></div>'"}
+            )(
+                Input(type="file", name="audio", id="batch-input", accept="audio/*,.zip", multiple=True,
+                      onchange="updateBatchForm()", style="display: none;"),
+                Button("Select Audio Files or Zip", type="button", id="batch-upload-btn", cls="upload-btn",
+                       onclick="document.getElementById('batch-input').click()"),
+
+                Div(style="margin-top: 16px;")(
+                    Div(style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 4px;")(
+                        Label("Qualifiers (shared by every file)", style="font-weight: 500;"),
+                        Label(style="font-size: 13px; color: var(--text-muted); cursor: pointer;")(
+                            Input(type="checkbox", name="skip_qualifiers", id="batch-skip-qual",
+                                  style="margin-right: 6px;",
+                                  onchange="updateBatchForm()"),
+                            "Skip qualifiers"
+                        )
+                    ),
+                    Textarea(name="qualifiers", id="batch-qualifiers-input",
+                             style="min-height: 120px;",
+                             oninput="updateBatchForm()")
+                ),
+
+                Button("Analyze Batch", type="submit", id="batch-analyze-btn", disabled=True, style="margin-top: 12px;")
+            )
         )
     )
 
 
+def render_batch_status(batch_id: str, jobs: list):
+    """Render per-file progress for a batch; polls itself until every job finishes"""
+    finished = [job for job in jobs if job['status'] in ('done', 'error')]
+    all_done = len(finished) == len(jobs)
+
+    rows = []
+    for job in jobs:
+        if job['status'] == 'done':
+            result = job['result']
+            status = Span(f"DARTS {result['darts_score']}/11", cls="darts-badge")
+            row_attrs = {
+                # Jobs finished before record ids only have the timestamp
+                'hx_get': f"/result/{result.get('record_id') or result['timestamp'].replace(' ', '_').replace(':', '~')}",
+                'hx_target': "#tab-content",
+                'hx_swap': "innerHTML",
+                'cls': "batch-row done"
+            }
+        elif job['status'] == 'error':
+            status = Span(job['error'] or "Failed", cls="error-text")
+            row_attrs = {'cls': "batch-row"}
+        else:
+            status = Span(job['stage'] or "Queued", cls="info-text")
+            row_attrs = {'cls': "batch-row"}
+        rows.append(Div(**row_attrs)(Span(job['filename'], cls="filename"), status))
+
+    poll_attrs = {} if all_done else {
+        'hx_get': f"/batches/{batch_id}",
+        'hx_trigger': "load delay:2s",
+        'hx_swap': "outerHTML"
+    }
+
+    return Div(id="batch-status", cls="card", **poll_attrs)(
+        Div(cls="card-header")(
+            H3(f"Batch: {len(finished)}/{len(jobs)} finished")
+        ),
+        Div(cls="card-body")(
+            Div(cls="batch-list")(*rows)
+        ),
+        Div(cls="card-footer")(
+            Button("Upload More",
+                   hx_get="/tab/process",
+                   hx_target="#tab-content",
+                   hx_swap="innerHTML"),
+            Button("View History",
+                   hx_get="/tab/history",
+                   hx_target="#tab-content",
+                   hx_swap="innerHTML",
+                   cls="btn-secondary",
+                   onclick="document.getElementById('tab-history').classList.add('active');document.getElementById('tab-process').classList.remove('active')")
+        ) if all_done else None
+    )
+
+
 def render_results_card(result_text: str, filename: str, timestamp: str, darts_score: str,
-                        transcript: str = "", audio_url: str = "", show_saved_toast: bool = False):
+                        transcript: str = "", audio_url: str = "", show_saved_toast: bool = False,
+                        cached: bool = False, structured: dict | None = None):
     """Render the results card with side-by-side analysis and transcript"""
     copy_js = """
     var text = document.getElementById('result-text-content').innerText;
@@ -280,7 +395,7 @@ def render_results_card(result_text: str, filename: str, timestamp: str, darts_s
     # Parse and prepare transcript content
     transcript_elements = []
     if has_transcript:
-        merged_lines = parse_transcript_lines(transcript)
+        merged_lines = parse_transcript_lines(transcript, _transcript_segments(structured))
         transcript_elements = [render_transcript_line_simple(entry) for entry in merged_lines]
 
     return Div(cls="results-wrapper" + (" has-transcript" if has_transcript else ""))(
@@ -288,7 +403,7 @@ def render_results_card(result_text: str, filename: str, timestamp: str, darts_s
         Div(cls="results-main")(
             Div(cls="card")(
                 Div(cls="card-header")(
-                    H3("Analysis"),
+                    H3("Analysis", Span("Cached", cls="cached-badge", title="Served from the analysis cache") if cached else None),
                     Button("Copy", id="copy-btn", cls="btn-copy", onclick=copy_js)
                 ),
                 Div(cls="search-box-container")(
@@ -339,20 +454,58 @@ def render_results_card(result_text: str, filename: str, timestamp: str, darts_s
     )
 
 
+def render_job_status(job_id: str, stage: str, filename: str):
+    """
+    Render the progress card for a queued job. The stage and partial analysis stream
+    in over SSE; the 'done' event loads the finished results card.
+    """
+    return Div(id="job-status", hx_ext="sse", sse_connect=f"/jobs/{job_id}/stream")(
+        Div(cls="card")(
+            Div(cls="card-header")(
+                H3(filename),
+                Span(stage or "Queued", cls="info-text", sse_swap="stage")
+            ),
+            Div(cls="card-body scrollable", sse_swap="message")(
+                Div(cls="processing-text")(
+                    Div(cls="spinner"),
+                    P("The analysis will appear here as it is written")
+                )
+            )
+        ),
+        Div(sse_swap="done")
+    )
+
+
+def render_job_stage(stage: str):
+    """Sent as a 'stage' SSE event whenever the job moves on; replaces the status line text"""
+    return Span(stage)
+
+
+def render_stream_partial(text: str):
+    """Render analysis markdown streamed so far"""
+    return Div(NotStr(markdown.markdown(text.replace('\\"', '"'))), cls="result-text")
+
+
+def render_job_done(job_id: str):
+    """Sent as the final SSE event: swaps the progress card for the saved result"""
+    return Div(hx_get=f"/jobs/{job_id}", hx_trigger="load",
+               hx_target="#job-status", hx_swap="outerHTML")
+
+
 def render_history_card(record: dict, idx: int):
     """Render a single history item card"""
     timestamp = record.get('Timestamp', 'Unknown')
     filename = record.get('Filename', 'Unknown')
-    summary = record.get('Summary', '')[:150]
-    full_result = record.get('Full Result', '')
-    darts_score = extract_darts_score(full_result)
+    summary = (record.get('Summary') or '')[:150]
+    darts_score = record.get('DARTS') or record_darts_score(record.get('Full Result', ''), record.get('Structured'))
 
     return Div(cls="card history-item",
-               hx_get=f"/result/{timestamp.replace(' ', '_').replace(':', '~')}",
+               hx_get=f"/result/{record['ID']}",
                hx_target="#tab-content",
                hx_swap="innerHTML")(
         Div(cls="card-header")(
-            Span(filename, cls="filename")
+            Span(filename, cls="filename"),
+            Span(f"{darts_score}/11", cls="darts-badge") if darts_score != "N/A" else None
         ),
         Div(cls="card-body")(
             P(timestamp, cls="timestamp"),
@@ -361,6 +514,75 @@ def render_history_card(record: dict, idx: int):
     )
 
 
+def render_history_search():
+    """Search box above the history grid; results replace the grid while a query is typed"""
+    return Div(cls="history-search")(
+        Input(type="search", name="q", placeholder="Search calls by filename, transcript or analysis...",
+              autocomplete="off",
+              hx_get="/search",
+              hx_trigger="input changed delay:300ms, search",
+              hx_target="#history-results",
+              hx_swap="innerHTML")
+    )
+
+
+def _highlight(text: str, terms: list):
+    """Split text into plain strings and Mark()s around words starting with a search term"""
+    pattern = re.compile(r"\b(" + "|".join(map(re.escape, terms)) + r")\w*", re.IGNORECASE)
+    parts, last = [], 0
+    for match in pattern.finditer(text):
+        parts.append(text[last:match.start()])
+        parts.append(Mark(match.group(0)))
+        last = match.end()
+    parts.append(text[last:])
+    return parts
+
+
+def render_search_results(query: str, search: dict):
+    """Ranked search hits with highlighted snippets"""
+    results, terms = search['results'], search['terms']
+    if not results:
+        return Div(cls="empty-state")(P(f'No calls match "{query}".'))
+
+    cards = []
+    for record in results:
+        timestamp = record['Timestamp']
+        darts_score = record['DARTS']
+        cards.append(
+            Div(cls="card history-item",
+                hx_get=f"/result/{record['ID']}",
+                hx_target="#tab-content",
+                hx_swap="innerHTML")(
+                Div(cls="card-header")(
+                    Span(*_highlight(record['Filename'], terms), cls="filename"),
+                    Span(f"{darts_score}/11", cls="darts-badge") if darts_score != "N/A" else None
+                ),
+                Div(cls="card-body")(
+                    P(timestamp, cls="timestamp"),
+                    P(Span(record['Match'], cls="search-match"), *_highlight(record['Snippet'], terms),
+                      cls="summary search-snippet")
+                )
+            )
+        )
+
+    return Div(
+        P(f"{len(results)} best matches ({search['ms']:.0f}ms)", cls="search-meta"),
+        Div(cls="history-grid")(*cards)
+    )
+
+
+def render_history_sentinel(cursor: tuple):
+    """Invisible grid cell that loads the next history page when scrolled into view"""
+    created_at, record_id = cursor
+    query = urlencode({'before': created_at, 'before_id': record_id})
+    return Div(cls="history-sentinel",
+               hx_get=f"/tab/history?{query}",
+               hx_trigger="revealed",
+               hx_swap="outerHTML")(
+        Div(cls="spinner")
+    )
+
+
 def render_edit_form(result_text: str, filename: str):
     """Render the edit form for re-analysis"""
     return Div(
@@ -392,12 +614,14 @@ def render_edit_form(result_text: str, filename: str):
     )
 
 
-def render_result_detail(record: dict, timestamp_clean: str, timestamp_encoded: str):
+def render_result_detail(record: dict):
     """Render full result detail view from history with side-by-side layout"""
     filename = record.get('Filename', 'Unknown')
     result_text = record.get('Full Result', '')
     transcript = record.get('Transcript', '')
     audio_url = record.get('Audio_URL', '')
+    original_audio_url = record.get('Original_Audio_URL', '')
+    structured = record.get('Structured')
 
     # Check if transcript is available
     has_transcript = bool(transcript and transcript.strip())
@@ -405,7 +629,7 @@ def render_result_detail(record: dict, timestamp_clean: str, timestamp_encoded:
     # Parse and prepare transcript content
     transcript_elements = []
     if has_transcript:
-        merged_lines = parse_transcript_lines(transcript)
+        merged_lines = parse_transcript_lines(transcript, _transcript_segments(structured))
         transcript_elements = [render_transcript_line_simple(entry) for entry in merged_lines]
 
     # Copy button JavaScript
@@ -566,7 +790,9 @@ def render_result_detail(record: dict, timestamp_clean: str, timestamp_encoded:
                     # Audio player - outside card-body to sit flush with header
                     Div(cls="audio-player-container")(
                         Audio(id="audio-player", controls=True, cls="audio-player", src=audio_url) if audio_url else None,
-                        P("Audio not available", cls="info-text") if not audio_url else None
+                        P("Audio not available", cls="info-text") if not audio_url else None,
+                        A("Download original recording", href=original_audio_url, download=True,
+                          cls="audio-original-link") if original_audio_url else None
                     ) if audio_url else None,
                     Div(cls="card-body scrollable")(
                         # Transcript
@@ -593,8 +819,29 @@ def render_analysis_content(result_text: str, filename: str, timestamp_clean: st
     )
 
 
-def parse_transcript_lines(transcript: str) -> list:
-    """Parse transcript and merge consecutive same-speaker lines"""
+def _transcript_segments(structured: dict | None) -> list | None:
+    """Transcript segments stored by structured-output mode, if any"""
+    return structured.get('transcript') if structured else None
+
+
+def parse_transcript_lines(transcript: str, segments: list | None = None) -> list:
+    """
+    Parse transcript and merge consecutive same-speaker lines.
+    Structured segments are used directly when available, skipping the regex parse.
+    """
+    if segments:
+        merged = []
+        for segment in segments:
+            speaker = segment['speaker'].lower()
+            text = segment['text'].strip()
+            if not text:
+                continue
+            if merged and merged[-1]['speaker'] == speaker:
+                merged[-1]['text'] += ' ' + text
+            else:
+                merged.append({'speaker': speaker, 'text': text})
+        return merged
+
     lines = transcript.split('\n')
     merged = []
     current_speaker = None
@@ -656,10 +903,11 @@ def render_transcript_line_simple(entry: dict):
     )
 
 
-def render_transcript_content(transcript: str, audio_url: str | None, filename: str, timestamp_clean: str):
+def render_transcript_content(transcript: str, audio_url: str | None, filename: str, timestamp_clean: str,
+                              structured: dict | None = None):
     """Render the transcript tab content with audio player (no timestamp sync)"""
     # Parse and merge consecutive same-speaker lines
-    merged_lines = parse_transcript_lines(transcript)
+    merged_lines = parse_transcript_lines(transcript, _transcript_segments(structured))
     transcript_elements = [render_transcript_line_simple(entry) for entry in merged_lines]
 
     return Div(
@@ -6,6 +6,15 @@ load_dotenv()
 # ============ SESSION CONFIG ============
 SESSION_SECRET = os.environ.get("SESSION_SECRET", "dev-secret-change-in-prod")
 
+# ============ WORKER CONFIG ============
+# Calls analyzed in the background at once, for single uploads and for batches
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "3"))
+
+# Most Gemini requests in flight at once: sizes the request pool and caps the adaptive limiter.
+# An audio call makes two requests together, so by default every running call gets two
+GEMINI_MAX_WORKERS = max(1, int(os.environ.get("GEMINI_MAX_WORKERS") or 2 * (JOB_WORKERS + BATCH_CONCURRENCY)))
+
 # ============ QA PROMPT ============
 QA_PROMPT = os.environ.get("QA_PROMPT", "QA_PROMPT not configured in .env")
 
@@ -194,6 +203,38 @@ button:disabled {
     font-weight: 600;
 }
 
+/* Cached result badge */
+.cached-badge {
+    display: inline-block;
+    margin-left: 10px;
+    padding: 2px 10px;
+    background: var(--border-light);
+    color: var(--text-muted);
+    border-radius: 20px;
+    font-size: 12px;
+    font-weight: 500;
+    vertical-align: middle;
+}
+
+/* Batch progress */
+.batch-list { display: flex; flex-direction: column; }
+.batch-row {
+    display: flex;
+    justify-content: space-between;
+    align-items: center;
+    gap: 12px;
+    padding: 10px 0;
+    border-bottom: 1px solid var(--border);
+}
+.batch-row:last-child { border-bottom: none; }
+.batch-row .filename {
+    overflow: hidden;
+    text-overflow: ellipsis;
+    white-space: nowrap;
+}
+.batch-row.done { cursor: pointer; }
+.batch-row.done:hover .filename { color: var(--primary); }
+
 /* Metadata */
 .metadata {
     margin-bottom: 16px;
@@ -307,6 +348,44 @@ mark {
     gap: 16px;
 }
 
+.history-search input[type="search"] {
+    width: 100%;
+    padding: 10px 12px;
+    border: 1px solid var(--border);
+    border-radius: var(--radius);
+    font-size: 14px;
+    font-family: inherit;
+    margin-bottom: 16px;
+    background: var(--card-bg-alt);
+    color: var(--text);
+}
+
+.search-meta {
+    font-size: 12px;
+    color: var(--text-muted);
+    margin-bottom: 12px;
+}
+
+.search-snippet mark {
+    background: rgba(250, 204, 21, 0.3);
+    color: var(--text);
+    border-radius: 2px;
+}
+
+.search-match {
+    font-size: 11px;
+    text-transform: uppercase;
+    color: var(--primary);
+    margin-right: 6px;
+}
+
+.history-sentinel {
+    grid-column: 1 / -1;
+    display: flex;
+    justify-content: center;
+    padding: 16px 0;
+}
+
 .history-item { cursor: pointer; transition: all 0.15s; }
 .history-item:hover {
     border-color: var(--border-light);
@@ -552,6 +631,13 @@ label {
     border-radius: var(--radius);
 }
 
+.audio-original-link {
+    display: inline-block;
+    margin-top: 6px;
+    font-size: 0.85em;
+    color: var(--text-muted);
+}
+
 /* Transcript styling */
 .transcript-container {
     background: var(--card-bg-alt);
@@ -1,3 +1,23 @@
-from .gemini import gemini_client, analyze_audio, analyze_transcript, reanalyze_text, extract_darts_score
-from .database import save_result, get_history, find_record_by_timestamp
-from .storage import upload_audio, get_audio_url, get_mock_audio
+from .gemini import (
+    gemini_client, analyze_audio, analyze_transcript, reanalyze_text, extract_darts_score,
+    record_darts_score, extract_call_metrics, MAX_AUDIO_BYTES
+)
+from .ratelimit import get_rate_limit_stats
+from .database import (
+    save_result, get_history, list_history, find_record, find_record_by_timestamp, search_results,
+    flush_writes, get_write_stats, get_replica_stats, get_compression_stats, get_analytics,
+    get_record_cache_stats
+)
+from .storage import (
+    upload_audio, get_audio_url, get_mock_audio_path, audio_content_type, get_storage_stats
+)
+from .audio import preprocess_audio, MAX_UPLOAD_BYTES
+from .cache import lookup_audio_analysis, store_audio_analysis, analyze_transcript_cached
+from .pipeline import (
+    build_qualifiers_context, pht_timestamp, run_pipeline, audio_mime_type, extract_zip_audio,
+    start_upload_retries, get_upload_stats
+)
+from .jobs import (
+    submit_job, submit_batch, get_job, get_job_partial, get_batch_jobs, resume_pending_jobs,
+    spool_upload, spool_zip_upload, get_memory_stats
+)
@@ -0,0 +1,136 @@
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+from pathlib import Path
+from .gemini import MAX_AUDIO_BYTES
+
+# Re-encode uploads to compact speech audio before analysis and storage
+AUDIO_PREPROCESS = os.environ.get("AUDIO_PREPROCESS", "on").lower() != "off"
+AUDIO_KEEP_ORIGINAL = os.environ.get("AUDIO_KEEP_ORIGINAL", "off").lower() == "on"
+AUDIO_BITRATE = os.environ.get("AUDIO_BITRATE", "24k")
+AUDIO_SAMPLE_RATE = 16000
+
+FFMPEG = shutil.which("ffmpeg")
+PREPROCESS_AVAILABLE = AUDIO_PREPROCESS and FFMPEG is not None
+if AUDIO_PREPROCESS and FFMPEG is None:
+    print("[WARN] ffmpeg not found, audio will be analyzed and stored as uploaded")
+
+# Raw uploads may exceed the Gemini limit when they'll be compressed first
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", "200000000")) if PREPROCESS_AVAILABLE else MAX_AUDIO_BYTES
+
+FFMPEG_TIMEOUT_SECONDS = 300
+
+
+def preprocess_audio(audio_path: Path, filename: str, mime_type: str) -> dict:
+    """
+    Downmix to mono, resample to 16kHz and encode as low-bitrate Opus, file to file.
+    Returns dict with 'path', 'filename', 'mime_type', 'original_size', 'size',
+    'seconds' and 'converted'. The converted file sits next to the input as
+    <input>.ogg and belongs to the caller. Falls back to the original path when
+    ffmpeg is unavailable, fails, or wouldn't make the file smaller.
+    """
+    original_size = audio_path.stat().st_size
+    result = {
+        'path': audio_path,
+        'filename': filename,
+        'mime_type': mime_type,
+        'original_size': original_size,
+        'size': original_size,
+        'seconds': 0.0,
+        'converted': False
+    }
+    if not PREPROCESS_AVAILABLE:
+        return result
+
+    start = time.perf_counter()
+    dst = audio_path.with_name(audio_path.name + ".ogg")
+    try:
+        # ffmpeg reads the spooled upload directly, so the raw audio never enters memory
+        subprocess.run(
+            [FFMPEG, "-hide_banner", "-loglevel", "error", "-y", "-i", str(audio_path),
+             "-vn", "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE),
+             "-c:a", "libopus", "-b:a", AUDIO_BITRATE, "-application", "voip",
+             # Bit-exact output so identical uploads compress to the same content-addressed blob
+             "-fflags", "+bitexact", "-flags:a", "+bitexact",
+             "-f", "ogg", str(dst)],
+            check=True, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS
+        )
+        converted_size = dst.stat().st_size
+    except (subprocess.SubprocessError, OSError) as e:
+        stderr = getattr(e, 'stderr', b'') or b''
+        print(f"[ERROR] preprocess_audio {filename}: {e} {stderr.decode(errors='ignore').strip()}")
+        dst.unlink(missing_ok=True)
+        return result
+
+    seconds = time.perf_counter() - start
+    if not converted_size or converted_size >= original_size:
+        dst.unlink(missing_ok=True)
+        return {**result, 'seconds': seconds}
+
+    reduction = 100 * (1 - converted_size / original_size)
+    print(f"[AUDIO] {filename}: {original_size / 1e6:.2f}MB -> {converted_size / 1e6:.2f}MB "
+          f"({reduction:.0f}% smaller) in {seconds:.2f}s")
+
+    return {
+        'path': dst,
+        'filename': os.path.splitext(filename)[0] + ".ogg",
+        'mime_type': "audio/ogg",
+        'original_size': original_size,
+        'size': converted_size,
+        'seconds': seconds,
+        'converted': True
+    }
+
+
+# Long calls are transcribed as overlapping segments in parallel
+LONG_CALL_SECONDS = int(os.environ.get("LONG_CALL_SECONDS", "900"))
+SEGMENT_SECONDS = int(os.environ.get("SEGMENT_SECONDS", "300"))
+SEGMENT_OVERLAP_SECONDS = int(os.environ.get("SEGMENT_OVERLAP_SECONDS", "10"))
+
+FFPROBE = shutil.which("ffprobe")
+CHUNKING_AVAILABLE = FFMPEG is not None and FFPROBE is not None
+
+
+def probe_duration(audio_path: Path) -> float | None:
+    """Audio duration in seconds, or None if it can't be determined"""
+    if not CHUNKING_AVAILABLE:
+        return None
+    try:
+        output = subprocess.run(
+            [FFPROBE, "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", str(audio_path)],
+            check=True, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS
+        ).stdout
+        return float(output.strip())
+    except (subprocess.SubprocessError, OSError, ValueError) as e:
+        print(f"[ERROR] probe_duration: {e}")
+        return None
+
+
+def split_audio(audio_path: Path, duration: float,
+                segment_seconds: int = SEGMENT_SECONDS,
+                overlap_seconds: int = SEGMENT_OVERLAP_SECONDS):
+    """
+    Cut audio into segments of segment_seconds, each running overlap_seconds
+    into the next. Yields (start_offset_seconds, ogg_bytes) as each one is cut,
+    so the caller can send it off before the next is encoded.
+    Only the (small, compressed) segments are read into memory.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        offset = 0
+        while offset < duration:
+            dst = Path(tmp) / f"segment_{offset}.ogg"
+            subprocess.run(
+                [FFMPEG, "-hide_banner", "-loglevel", "error", "-y",
+                 "-ss", str(offset), "-t", str(segment_seconds + overlap_seconds), "-i", str(audio_path),
+                 "-vn", "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE),
+                 "-c:a", "libopus", "-b:a", AUDIO_BITRATE, "-application", "voip",
+                 str(dst)],
+                check=True, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS
+            )
+            segment = dst.read_bytes()
+            dst.unlink()
+            yield offset, segment
+            offset += segment_seconds
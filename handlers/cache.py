@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import hashlib
+from config import QA_PROMPT
+from .database import connection
+from .gemini import (
+    gemini_client, GEMINI_MODEL, TRANSCRIPT_PROMPT, STRUCTURED_PROMPT, GEMINI_STRUCTURED_OUTPUT,
+    CallAnalysis, analyze_transcript
+)
+
+# Content-addressed cache for Gemini results (set ANALYSIS_CACHE=off to disable)
+ANALYSIS_CACHE_ENABLED = os.environ.get("ANALYSIS_CACHE", "on").lower() != "off"
+ANALYSIS_CACHE_TTL_DAYS = float(os.environ.get("ANALYSIS_CACHE_TTL_DAYS", "30"))
+ANALYSIS_CACHE_MAX_MB = float(os.environ.get("ANALYSIS_CACHE_MAX_MB", "200"))
+
+# Editing any prompt or the structured response schema changes the version,
+# so stale analyses are never served
+PROMPT_VERSION = hashlib.sha256((
+    QA_PROMPT + TRANSCRIPT_PROMPT + STRUCTURED_PROMPT
+    + json.dumps(CallAnalysis.model_json_schema(), sort_keys=True)
+).encode()).hexdigest()[:12]
+
+
+def _cache_key(kind: str, content_hash: str, qualifiers_context: str) -> str:
+    """Build the cache key from content, prompt version, model and qualifiers"""
+    qualifiers_hash = hashlib.sha256(qualifiers_context.encode()).hexdigest()
+    raw = "|".join([kind, content_hash, PROMPT_VERSION, GEMINI_MODEL, qualifiers_hash])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _get_cached(key: str) -> dict | None:
+    """Return cached {'analysis', 'transcript', 'structured', 'audio_blob'} or None on miss/expiry"""
+    try:
+        with connection() as conn:
+            now = time.time()
+            cutoff = now - ANALYSIS_CACHE_TTL_DAYS * 86400
+            row = conn.execute(
+                """SELECT analysis, transcript, structured_json, audio_blob FROM analysis_cache
+                   WHERE cache_key = ? AND created_at > ?""",
+                (key, cutoff)
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute("UPDATE analysis_cache SET last_used_at = ? WHERE cache_key = ?", (now, key))
+            conn.commit()
+        return {
+            'analysis': row[0],
+            'transcript': row[1] or "",
+            'structured': json.loads(row[2]) if row[2] else None,
+            'audio_blob': row[3] or None
+        }
+    except Exception as e:
+        print(f"[ERROR] analysis cache get: {e}")
+        return None
+
+
+def _put_cached(key: str, analysis: str, transcript: str = "", structured: dict | None = None,
+                audio_blob: str | None = None):
+    """Store a result and evict expired or least recently used entries"""
+    try:
+        with connection() as conn:
+            now = time.time()
+            structured_json = json.dumps(structured) if structured else None
+            size_bytes = len(analysis.encode()) + len(transcript.encode()) + len(structured_json or "")
+            conn.execute(
+                """INSERT OR REPLACE INTO analysis_cache
+                   (cache_key, analysis, transcript, structured_json, audio_blob, size_bytes, created_at, last_used_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (key, analysis, transcript, structured_json, audio_blob, size_bytes, now, now)
+            )
+            _evict(conn, now)
+            conn.commit()
+    except Exception as e:
+        print(f"[ERROR] analysis cache put: {e}")
+
+
+def _evict(conn, now: float):
+    """Drop entries past the TTL, then the least recently used until under the size cap"""
+    conn.execute("DELETE FROM analysis_cache WHERE created_at <= ?",
+                 (now - ANALYSIS_CACHE_TTL_DAYS * 86400,))
+
+    max_bytes = ANALYSIS_CACHE_MAX_MB * 1_000_000
+    total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM analysis_cache").fetchone()[0]
+    if total <= max_bytes:
+        return
+
+    rows = conn.execute(
+        "SELECT cache_key, size_bytes FROM analysis_cache ORDER BY last_used_at ASC"
+    ).fetchall()
+    for cache_key, size_bytes in rows:
+        if total <= max_bytes:
+            break
+        conn.execute("DELETE FROM analysis_cache WHERE cache_key = ?", (cache_key,))
+        total -= size_bytes
+
+
+def lookup_audio_analysis(digest: str, qualifiers_context: str = "") -> tuple:
+    """
+    Check the cache for an uploaded recording, keyed on the sha256_file digest of
+    the file as uploaded (before any preprocessing), so a hit costs one hash of the file.
+    Returns (cache_key, hit); cache_key is None when results aren't cached.
+    hit is the _get_cached dict, with 'audio_blob' the stored compressed audio if known.
+    """
+    # Mock results are never cached
+    if not ANALYSIS_CACHE_ENABLED or gemini_client is None:
+        return None, None
+
+    kind = "upload-structured" if GEMINI_STRUCTURED_OUTPUT else "upload"
+    key = _cache_key(kind, digest, qualifiers_context)
+    return key, _get_cached(key)
+
+
+def store_audio_analysis(key: str | None, result: dict, audio_blob: str | None = None):
+    """Cache an analyze_audio result under a lookup_audio_analysis key, with its stored audio blob"""
+    if key is None:
+        return
+    _put_cached(key, result['analysis'], result['transcript'], result.get('structured'), audio_blob)
+
+
+def analyze_transcript_cached(transcript: str, qualifiers_context: str = "", on_chunk=None) -> dict:
+    """
+    analyze_transcript with the analysis cache in front.
+    Returns dict with 'analysis' and 'cached' keys.
+    """
+    if not ANALYSIS_CACHE_ENABLED or gemini_client is None:
+        return {'analysis': analyze_transcript(transcript, qualifiers_context, on_chunk), 'cached': False}
+
+    key = _cache_key("transcript", hashlib.sha256(transcript.encode()).hexdigest(), qualifiers_context)
+    hit = _get_cached(key)
+    if hit:
+        if on_chunk:
+            on_chunk(hit['analysis'])
+        return {'analysis': hit['analysis'], 'cached': True}
+
+    analysis = analyze_transcript(transcript, qualifiers_context, on_chunk)
+    _put_cached(key, analysis)
+    return {'analysis': analysis, 'cached': False}
@@ -1,104 +1,784 @@
 import os
+import re
+import json
+import time
+import zlib
+import queue
+import atexit
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
 import libsql_experimental as libsql
+from .gemini import record_darts_score, summarize_result, extract_call_metrics
+from .migrations import apply_migrations
 
-# Turso connection
-_connection = None
+# Connections per process; each checkout is used by one thread at a time
+TURSO_POOL_SIZE = int(os.environ.get("TURSO_POOL_SIZE", "4"))
 
+# Idle connections older than this are pinged before reuse
+POOL_HEALTH_CHECK_SECONDS = 30
 
-def get_connection():
-    """Get or create Turso database connection"""
-    global _connection
-    if _connection is None:
+# Optional embedded replica: reads come from a local file, libsql forwards writes to the primary
+TURSO_REPLICA_PATH = os.environ.get("TURSO_REPLICA_PATH", "")
+TURSO_SYNC_INTERVAL = float(os.environ.get("TURSO_SYNC_INTERVAL", "60"))
+
+
+class ConnectionPool:
+    """Bounded pool of Turso connections with health checks on reuse"""
+
+    def __init__(self, size: int):
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connect(self):
         url = os.environ.get("TURSO_DATABASE_URL")
         token = os.environ.get("TURSO_AUTH_TOKEN")
 
         if not url or not token:
             raise RuntimeError("TURSO_DATABASE_URL and TURSO_AUTH_TOKEN must be set")
 
-        _connection = libsql.connect(database=url, auth_token=token)
-        _init_schema()
+        if TURSO_REPLICA_PATH:
+            conn = libsql.connect(TURSO_REPLICA_PATH, sync_url=url, auth_token=token)
+        else:
+            conn = libsql.connect(database=url, auth_token=token)
+        with self._schema_lock:
+            if not self._schema_ready:
+                if TURSO_REPLICA_PATH:
+                    _sync(conn)
+                _init_schema(conn)
+                if TURSO_REPLICA_PATH:
+                    _sync(conn)
+                    _start_sync_thread()
+                self._schema_ready = True
+        return conn
 
-    return _connection
+    def _checkout(self):
+        """Reuse the most recently returned connection, reconnecting if it went stale"""
+        while True:
+            try:
+                conn, returned_at = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
 
+            if time.monotonic() - returned_at < POOL_HEALTH_CHECK_SECONDS:
+                return conn
+            try:
+                conn.execute("SELECT 1").fetchone()
+                return conn
+            except Exception as e:
+                print(f"[WARN] Dropping dead database connection: {e}")
+                _close_quietly(conn)
 
-def _init_schema():
-    """Initialize database schema if not exists"""
-    conn = _connection
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS qa_results (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT UNIQUE NOT NULL,
-            filename TEXT NOT NULL,
-            full_result TEXT,
-            transcript TEXT,
-            audio_url TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    conn.commit()
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        except Exception:
+            # Don't hand a connection in an unknown state to the next caller
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    _close_quietly(conn)
+                    conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._idle.put((conn, time.monotonic()))
+            self._slots.release()
 
 
-def save_result(timestamp: str, filename: str, result_text: str,
-                transcript: str = "", audio_url: str = "") -> bool:
-    """Save result to Turso database. Returns True on success."""
+def _close_quietly(conn):
     try:
-        conn = get_connection()
-        conn.execute(
-            """INSERT OR REPLACE INTO qa_results
-               (timestamp, filename, full_result, transcript, audio_url)
-               VALUES (?, ?, ?, ?, ?)""",
-            (timestamp, filename, result_text, transcript, audio_url)
-        )
-        conn.commit()
-        return True
+        conn.close()
+    except Exception:
+        pass
+
+
+_pool = ConnectionPool(TURSO_POOL_SIZE)
+
+
+def connection():
+    """
+    Check out a pooled Turso connection:
+
+        with connection() as conn:
+            conn.execute(...)
+    """
+    return _pool.connection()
+
+
+_sync_lock = threading.Lock()
+_sync_stats = {'syncs': 0, 'errors': 0, 'seconds': 0.0, 'last_sync_at': None}
+
+
+def _sync(conn):
+    """Pull new frames from the primary into the local replica file"""
+    start = time.perf_counter()
+    try:
+        with _sync_lock:
+            conn.sync()
+    except Exception as e:
+        print(f"[WARN] Replica sync failed: {e}")
+        with _sync_lock:
+            _sync_stats['errors'] += 1
+        return
+    with _sync_lock:
+        _sync_stats['syncs'] += 1
+        _sync_stats['seconds'] += time.perf_counter() - start
+        _sync_stats['last_sync_at'] = time.time()
+
+
+def sync_replica():
+    """Bring the embedded replica up to date now (no-op without TURSO_REPLICA_PATH)"""
+    if not TURSO_REPLICA_PATH:
+        return
+    with connection() as conn:
+        _sync(conn)
+
+
+def _start_sync_thread():
+    """Sync every TURSO_SYNC_INTERVAL seconds so other writers' records show up"""
+    def loop():
+        while True:
+            time.sleep(TURSO_SYNC_INTERVAL)
+            try:
+                sync_replica()
+            except Exception as e:
+                print(f"[WARN] Replica sync failed: {e}")
+
+    threading.Thread(target=loop, name="replica-sync", daemon=True).start()
+
+
+def get_replica_stats() -> dict:
+    """Embedded replica sync counters for /api/stats"""
+    if not TURSO_REPLICA_PATH:
+        return {'enabled': False}
+    with _sync_lock:
+        stats = dict(_sync_stats)
+    stats['enabled'] = True
+    stats['seconds'] = round(stats['seconds'], 3)
+    stats['age_seconds'] = round(time.time() - stats['last_sync_at'], 1) if stats['last_sync_at'] else None
+    return stats
+
+
+def _init_schema(conn):
+    """Bring the database schema up to date (see migrations.py)"""
+    apply_migrations(conn)
+
+
+# Long text columns (full_result, transcript) are stored zlib-compressed as BLOBs.
+# Rows written before compression hold plain TEXT and are returned as-is.
+TEXT_COMPRESSION = os.environ.get("TEXT_COMPRESSION", "on").lower() != "off"
+COMPRESS_MIN_BYTES = 512
+_ZLIB_MARKER = b"\x00zl1"
+
+_codec_stats = {'raw_bytes': 0, 'stored_bytes': 0, 'decodes': 0, 'decode_seconds': 0.0}
+_codec_lock = threading.Lock()
+
+
+def _pack_text(text: str):
+    """Compress text for storage; short text stays plain TEXT"""
+    raw = (text or "").encode()
+    if not TEXT_COMPRESSION or len(raw) < COMPRESS_MIN_BYTES:
+        packed = text
+        stored = len(raw)
+    else:
+        packed = _ZLIB_MARKER + zlib.compress(raw, 6)
+        stored = len(packed)
+    with _codec_lock:
+        _codec_stats['raw_bytes'] += len(raw)
+        _codec_stats['stored_bytes'] += stored
+    return packed
+
+
+def _unpack_text(value) -> str:
+    """Inverse of _pack_text; plain TEXT (legacy rows) passes through"""
+    if not isinstance(value, (bytes, bytearray)):
+        return value
+    start = time.perf_counter()
+    if not value.startswith(_ZLIB_MARKER):
+        raise ValueError("Unknown text encoding in database column")
+    text = zlib.decompress(value[len(_ZLIB_MARKER):]).decode()
+    with _codec_lock:
+        _codec_stats['decodes'] += 1
+        _codec_stats['decode_seconds'] += time.perf_counter() - start
+    return text
+
+
+class LazyRecord(dict):
+    """Record dict that decompresses its text fields the first time they are read"""
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, (bytes, bytearray)):
+            value = _unpack_text(value)
+            super().__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+def get_compression_stats() -> dict:
+    """Stored vs raw size of text written by this process, and time spent decoding reads"""
+    with _codec_lock:
+        stats = dict(_codec_stats)
+    stats['enabled'] = TEXT_COMPRESSION
+    stats['ratio'] = round(stats['raw_bytes'] / stats['stored_bytes'], 2) if stats['stored_bytes'] else None
+    stats['decode_ms_avg'] = (round(stats['decode_seconds'] * 1000 / stats['decodes'], 3)
+                              if stats['decodes'] else None)
+    stats['decode_seconds'] = round(stats['decode_seconds'], 3)
+    return stats
+
+
+# Optional write-behind: saves from concurrent jobs are grouped into one transaction
+SAVE_WRITE_BEHIND = os.environ.get("SAVE_WRITE_BEHIND", "off").lower() == "on"
+SAVE_BATCH_SIZE = int(os.environ.get("SAVE_BATCH_SIZE", "20"))
+SAVE_FLUSH_MS = int(os.environ.get("SAVE_FLUSH_MS", "200"))
+
+
+def _insert_result(conn, row: tuple) -> int:
+    """INSERT one record built by _result_row and index it for search (caller commits). Returns its id."""
+    stored, searchable = row
+    record_id = conn.execute(
+        """INSERT INTO qa_results
+           (timestamp, filename, full_result, transcript, audio_url, structured_json,
+            summary, darts_score, darts_desire, darts_authority, darts_revenue, darts_timeliness,
+            darts_size, darts_total, objection_count, meeting_confirmed, original_audio_url, metrics_parsed)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+           RETURNING id""",
+        stored
+    ).fetchone()[0]
+    conn.execute(
+        "INSERT INTO qa_results_fts (rowid, filename, full_result, transcript) VALUES (?, ?, ?, ?)",
+        (record_id, *searchable)
+    )
+    return record_id
+
+
+def _result_row(timestamp, filename, result_text, transcript, audio_url, structured, original_audio_url) -> tuple:
+    """(stored qa_results values, plain text for the search index)"""
+    metrics = extract_call_metrics(result_text, structured)
+    stored = (timestamp, filename, _pack_text(result_text), _pack_text(transcript), audio_url,
+              json.dumps(structured) if structured else None,
+              summarize_result(result_text), record_darts_score(result_text, structured),
+              metrics['desire'], metrics['authority'], metrics['revenue'], metrics['timeliness'],
+              metrics['size'], metrics['total'], metrics['objections'], metrics['meeting_confirmed'],
+              original_audio_url or None)
+    return stored, (filename, result_text or "", transcript or "")
+
+
+class WriteBehindQueue:
+    """
+    Buffers qa_results inserts and commits them in groups of up to batch_size,
+    or after flush_ms once the first write of a group arrives.
+    Each write gets a Future that resolves to the new record id once its group
+    is committed, or None if it couldn't be saved.
+    """
+
+    def __init__(self, batch_size: int, flush_ms: int):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {'writes': 0, 'batches': 0, 'failures': 0}
+
+    def submit(self, row: tuple) -> Future:
+        """Queue a row; returns None once closed (caller writes directly)"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                return None
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="save-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((row, future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            group = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(group) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._commit(group)
+                    return
+                group.append(item)
+            self._commit(group)
+
+    def _commit(self, group: list):
+        """Write a group in one transaction; on failure retry row by row so one bad row can't sink the rest"""
+        try:
+            with connection() as conn:
+                record_ids = [_insert_result(conn, row) for row, _ in group]
+                conn.commit()
+                if TURSO_REPLICA_PATH:
+                    _sync(conn)
+            self._count(writes=len(group), batches=1)
+            for (_, future), record_id in zip(group, record_ids):
+                future.set_result(record_id)
+            return
+        except Exception as e:
+            print(f"[WARN] Grouped save of {len(group)} result(s) failed, retrying individually: {e}")
+
+        for row, future in group:
+            record_id = _write_now(row)
+            self._count(writes=1 if record_id else 0, failures=0 if record_id else 1)
+            future.set_result(record_id)
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self.stats[name] += delta
+
+    def close(self, timeout: float = 30.0):
+        """Stop accepting writes and commit everything still buffered"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+        if thread.is_alive():
+            print("[ERROR] Save writer did not finish flushing before shutdown")
+
+
+_writer = WriteBehindQueue(SAVE_BATCH_SIZE, SAVE_FLUSH_MS) if SAVE_WRITE_BEHIND else None
+
+
+def _write_now(row: tuple) -> int | None:
+    try:
+        with connection() as conn:
+            record_id = _insert_result(conn, row)
+            conn.commit()
+            # Make the new record visible to history reads straight away
+            if TURSO_REPLICA_PATH:
+                _sync(conn)
+        return record_id
     except Exception as e:
         print(f"[ERROR] save_result: {e}")
-        return False
+        return None
+
+
+def save_result(timestamp: str, filename: str, result_text: str,
+                transcript: str = "", audio_url: str = "", structured: dict | None = None,
+                original_audio_url: str = "") -> int | None:
+    """
+    Save result to Turso database as a new record (the timestamp is display data only).
+    original_audio_url is the uncompressed upload's blob when AUDIO_KEEP_ORIGINAL is on.
+    Returns the record id once the row is committed, or None on failure.
+    With SAVE_WRITE_BEHIND=on the insert is grouped with other pending saves.
+    """
+    row = _result_row(timestamp, filename, result_text, transcript, audio_url, structured, original_audio_url)
+    future = _writer.submit(row) if _writer else None
+    if future is None:
+        return _write_now(row)
+    return future.result()
+
+
+def flush_writes():
+    """Commit any buffered saves; called on app shutdown and at interpreter exit"""
+    if _writer:
+        _writer.close()
+
+
+def get_write_stats() -> dict:
+    """Write-behind counters for /api/stats"""
+    if not _writer:
+        return {'write_behind': False}
+    with _writer._lock:
+        stats = dict(_writer.stats)
+    stats['write_behind'] = True
+    stats['pending'] = _writer._queue.qsize()
+    return stats
+
+
+atexit.register(flush_writes)
+
+
+_RECORD_COLUMNS = "timestamp, filename, full_result, transcript, audio_url, structured_json, id, original_audio_url"
+
+
+def _row_to_record(row) -> dict:
+    """Map a qa_results row (selected with _RECORD_COLUMNS) to a record dict"""
+    return LazyRecord({
+        'Timestamp': row[0],
+        'Filename': row[1],
+        'Full Result': row[2],
+        'Transcript': row[3],
+        'Audio_URL': row[4],
+        'Structured': json.loads(row[5]) if row[5] else None,
+        'ID': row[6],
+        'Original_Audio_URL': row[7] or ''
+    })
 
 
 def get_history() -> list:
     """Get all records from database"""
     try:
-        conn = get_connection()
-        cursor = conn.execute(
-            """SELECT timestamp, filename, full_result, transcript, audio_url
-               FROM qa_results ORDER BY created_at DESC LIMIT 100"""
-        )
-        rows = cursor.fetchall()
-        return [
-            {
-                'Timestamp': row[0],
-                'Filename': row[1],
-                'Full Result': row[2],
-                'Transcript': row[3],
-                'Audio_URL': row[4]
-            }
-            for row in rows
-        ]
+        with connection() as conn:
+            cursor = conn.execute(
+                f"""SELECT {_RECORD_COLUMNS}
+                   FROM qa_results ORDER BY created_at DESC LIMIT 100"""
+            )
+            return [_row_to_record(row) for row in cursor.fetchall()]
     except Exception as e:
         print(f"[ERROR] get_history: {e}")
         return []
 
 
-def find_record_by_timestamp(timestamp: str) -> dict | None:
-    """Find a specific record by timestamp"""
+# Full records kept in memory so switching result sub-tabs doesn't refetch them
+RECORD_CACHE_MB = float(os.environ.get("RECORD_CACHE_MB", "32"))
+RECORD_CACHE_TTL_SECONDS = float(os.environ.get("RECORD_CACHE_TTL_SECONDS", "300"))
+
+
+class RecordCache:
+    """LRU of records by id, bounded by total size in bytes, entries expire after ttl"""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # record id -> (record, size, stored_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def _size(record: dict) -> int:
+        return sum(len(value) for value in dict.values(record) if isinstance(value, (str, bytes, bytearray)))
+
+    def get(self, record_id: int) -> dict | None:
+        """Copy of the cached record (callers may modify it), or None"""
+        with self._lock:
+            entry = self._entries.get(record_id)
+            if entry and time.monotonic() - entry[2] < self.ttl:
+                self._entries.move_to_end(record_id)
+                self.stats['hits'] += 1
+                return LazyRecord(entry[0])
+            if entry:
+                self._drop(record_id)
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, record_id: int, record: dict):
+        size = self._size(record)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if record_id in self._entries:
+                self._drop(record_id)
+            self._entries[record_id] = (LazyRecord(record), size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def _drop(self, record_id: int):
+        _, size, _ = self._entries.pop(record_id)
+        self._bytes -= size
+
+    def discard(self, record_id: int):
+        """Forget a record after it changes in the database"""
+        with self._lock:
+            if record_id in self._entries:
+                self._drop(record_id)
+
+
+_records = RecordCache(int(RECORD_CACHE_MB * 1_000_000), RECORD_CACHE_TTL_SECONDS)
+
+
+def get_record_cache_stats() -> dict:
+    """Record cache counters for /api/stats"""
+    with _records._lock:
+        stats = dict(_records.stats)
+        stats['entries'] = len(_records._entries)
+        stats['bytes'] = _records._bytes
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+    return stats
+
+
+def find_record(record_id: int) -> dict | None:
+    """Find a record by id (served from the record cache when possible)"""
+    cached = _records.get(record_id)
+    if cached is not None:
+        return cached
     try:
-        conn = get_connection()
-        cursor = conn.execute(
-            """SELECT timestamp, filename, full_result, transcript, audio_url
-               FROM qa_results WHERE timestamp = ?""",
-            (timestamp,)
-        )
-        row = cursor.fetchone()
-        if row:
-            return {
-                'Timestamp': row[0],
-                'Filename': row[1],
-                'Full Result': row[2],
-                'Transcript': row[3],
-                'Audio_URL': row[4]
-            }
+        with connection() as conn:
+            row = conn.execute(
+                f"SELECT {_RECORD_COLUMNS} FROM qa_results WHERE id = ?", (record_id,)
+            ).fetchone()
+        if not row:
+            return None
+        record = _row_to_record(row)
+        _records.put(record_id, record)
+        return LazyRecord(record)
+    except Exception as e:
+        print(f"[ERROR] find_record: {e}")
         return None
+
+
+def mark_upload_pending(record_id: int, path: str, filename: str):
+    """Queue a saved record's audio for another upload attempt from the local copy at path"""
+    now = time.time()
+    with connection() as conn:
+        conn.execute(
+            """INSERT OR REPLACE INTO pending_uploads (record_id, path, filename, next_attempt_at, created_at)
+               VALUES (?, ?, ?, ?, ?)""",
+            (record_id, path, filename, now, now)
+        )
+        conn.commit()
+
+
+def get_pending_uploads(limit: int = 20) -> list:
+    """Pending uploads due for a retry, oldest first: [{'record_id', 'path', 'filename', 'attempts'}]"""
+    try:
+        with connection() as conn:
+            rows = conn.execute(
+                """SELECT record_id, path, filename, attempts FROM pending_uploads
+                   WHERE next_attempt_at <= ? ORDER BY created_at LIMIT ?""",
+                (time.time(), limit)
+            ).fetchall()
+        return [dict(zip(('record_id', 'path', 'filename', 'attempts'), row)) for row in rows]
+    except Exception as e:
+        print(f"[ERROR] get_pending_uploads: {e}")
+        return []
+
+
+def record_upload_failure(record_id: int, error: str, retry_in: float):
+    """Note a failed retry and push the next attempt back by retry_in seconds"""
+    with connection() as conn:
+        conn.execute(
+            """UPDATE pending_uploads SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?
+               WHERE record_id = ?""",
+            (error, time.time() + retry_in, record_id)
+        )
+        conn.commit()
+
+
+def set_record_audio(record_id: int, audio_url: str):
+    """Attach an uploaded blob to a saved record and clear its pending upload"""
+    with connection() as conn:
+        conn.execute("UPDATE qa_results SET audio_url = ? WHERE id = ?", (audio_url, record_id))
+        conn.execute("DELETE FROM pending_uploads WHERE record_id = ?", (record_id,))
+        conn.commit()
+        if TURSO_REPLICA_PATH:
+            _sync(conn)
+    _records.discard(record_id)
+
+
+def find_record_by_timestamp(timestamp: str) -> dict | None:
+    """Find the latest record saved at a timestamp (for links made before record ids)"""
+    try:
+        with connection() as conn:
+            row = conn.execute(
+                "SELECT id FROM qa_results WHERE timestamp = ? ORDER BY id DESC LIMIT 1", (timestamp,)
+            ).fetchone()
+        return find_record(row[0]) if row else None
     except Exception as e:
         print(f"[ERROR] find_record_by_timestamp: {e}")
         return None
+
+
+def list_history(limit: int = 24, before: str | None = None, before_id: int | None = None) -> tuple:
+    """
+    One page of history cards, newest first: only the card fields, no result text.
+    Pass the previous page's cursor (created_at, id) as before/before_id.
+    Returns (records, next_cursor) where next_cursor is None on the last page.
+    """
+    try:
+        with connection() as conn:
+            if before is None:
+                rows = conn.execute(
+                    """SELECT id, created_at, timestamp, filename, summary, darts_score
+                       FROM qa_results ORDER BY created_at DESC, id DESC LIMIT ?""",
+                    (limit + 1,)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    """SELECT id, created_at, timestamp, filename, summary, darts_score
+                       FROM qa_results
+                       WHERE (created_at, id) < (?, ?)
+                       ORDER BY created_at DESC, id DESC LIMIT ?""",
+                    (before, before_id, limit + 1)
+                ).fetchall()
+
+        page = rows[:limit]
+        records = [
+            {
+                'ID': row[0],
+                'Timestamp': row[2],
+                'Filename': row[3],
+                'Summary': row[4] or '',
+                'DARTS': row[5] or 'N/A'
+            }
+            for row in page
+        ]
+        next_cursor = (page[-1][1], page[-1][0]) if len(rows) > limit else None
+        return records, next_cursor
+    except Exception as e:
+        print(f"[ERROR] list_history: {e}")
+        return [], None
+
+
+# Only the most recent matches are ranked, so common words stay fast on large histories
+SEARCH_CANDIDATES = 1000
+
+
+def _search_terms(query: str) -> list:
+    """Words from a search box query (FTS5 operators and punctuation are dropped)"""
+    return re.findall(r"\w+", query.lower())[:10]
+
+
+def _snippet(text: str, terms: list, width: int = 160) -> str:
+    """Window of text around the first matching term, or '' if none matches"""
+    if not text:
+        return ""
+    match = re.search(r"\b(" + "|".join(map(re.escape, terms)) + r")", text, re.IGNORECASE)
+    if not match:
+        return ""
+    start = max(0, match.start() - width // 3)
+    end = min(len(text), start + width)
+    snippet = re.sub(r"\s+", " ", text[start:end]).strip()
+    return ("..." if start > 0 else "") + snippet + ("..." if end < len(text) else "")
+
+
+def search_results(query: str, limit: int = 20) -> dict:
+    """
+    Full-text search over filenames, analyses and transcripts, best match first
+    among the SEARCH_CANDIDATES most recent matching calls.
+    Returns dict with 'results' (records with 'Snippet' and 'Match'), 'terms' and 'ms'.
+    """
+    start = time.perf_counter()
+    terms = _search_terms(query)
+    if not terms:
+        return {'results': [], 'terms': [], 'ms': 0.0}
+
+    # Every word must appear; the last one may be a prefix (search-as-you-type)
+    match_query = " ".join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+    try:
+        with connection() as conn:
+            rows = conn.execute(
+                """SELECT r.id, r.timestamp, r.filename, r.full_result, r.transcript, r.darts_score
+                   FROM (SELECT rowid, bm25(qa_results_fts, 10.0, 1.0, 2.0) AS score
+                         FROM qa_results_fts WHERE qa_results_fts MATCH ?
+                         ORDER BY rowid DESC LIMIT ?) hits
+                   JOIN qa_results r ON r.id = hits.rowid
+                   ORDER BY hits.score
+                   LIMIT ?""",
+                (match_query.strip(), SEARCH_CANDIDATES, limit)
+            ).fetchall()
+    except Exception as e:
+        print(f"[ERROR] search_results: {e}")
+        return {'results': [], 'terms': terms, 'ms': 0.0}
+
+    results = []
+    for record_id, timestamp, filename, full_result, transcript, darts_score in rows:
+        # Snippets only for the page of hits, so only these rows are decompressed
+        snippet, match = _snippet(_unpack_text(transcript), terms), "Transcript"
+        if not snippet:
+            snippet, match = _snippet(_unpack_text(full_result), terms), "Analysis"
+        if not snippet:
+            match = "Filename"
+        results.append({
+            'ID': record_id,
+            'Timestamp': timestamp,
+            'Filename': filename,
+            'DARTS': darts_score or 'N/A',
+            'Snippet': snippet,
+            'Match': match
+        })
+
+    ms = (time.perf_counter() - start) * 1000
+    print(f"[TIMING] search '{query}': {len(results)} hits in {ms:.1f}ms")
+    return {'results': results, 'terms': terms, 'ms': ms}
+
+
+def get_analytics(days: int = 30) -> dict:
+    """
+    DARTS, objection and meeting statistics computed in SQL over stored metrics:
+    overall averages, total-score and sub-score distributions, and a daily trend
+    for the last `days` days.
+    """
+    since = f"-{int(days)} days"
+    with connection() as conn:
+        overall = conn.execute(
+            """SELECT COUNT(*), COUNT(darts_total), AVG(darts_total),
+                      AVG(darts_desire), AVG(darts_authority), AVG(darts_revenue),
+                      AVG(darts_timeliness), AVG(darts_size),
+                      AVG(objection_count), AVG(meeting_confirmed), COUNT(meeting_confirmed)
+               FROM qa_results WHERE created_at >= datetime('now', ?)""",
+            (since,)
+        ).fetchone()
+
+        totals = conn.execute(
+            """SELECT darts_total, COUNT(*) FROM qa_results
+               WHERE darts_total IS NOT NULL AND created_at >= datetime('now', ?)
+               GROUP BY darts_total ORDER BY darts_total""",
+            (since,)
+        ).fetchall()
+
+        sub_scores = conn.execute(
+            """SELECT field, score, COUNT(*) FROM (
+                   SELECT 'desire' AS field, darts_desire AS score, created_at FROM qa_results
+                   UNION ALL SELECT 'authority', darts_authority, created_at FROM qa_results
+                   UNION ALL SELECT 'revenue', darts_revenue, created_at FROM qa_results
+                   UNION ALL SELECT 'timeliness', darts_timeliness, created_at FROM qa_results
+                   UNION ALL SELECT 'size', darts_size, created_at FROM qa_results
+               )
+               WHERE score IS NOT NULL AND created_at >= datetime('now', ?)
+               GROUP BY field, score ORDER BY field, score""",
+            (since,)
+        ).fetchall()
+
+        trend = conn.execute(
+            """SELECT date(created_at), COUNT(*), AVG(darts_total), AVG(meeting_confirmed), AVG(objection_count)
+               FROM qa_results WHERE created_at >= datetime('now', ?)
+               GROUP BY date(created_at) ORDER BY date(created_at)""",
+            (since,)
+        ).fetchall()
+
+    def rounded(value):
+        return round(value, 2) if value is not None else None
+
+    distributions = {}
+    for field, score, count in sub_scores:
+        distributions.setdefault(field, {})[score] = count
+
+    return {
+        'days': int(days),
+        'calls': overall[0],
+        'scored_calls': overall[1],
+        'avg_total': rounded(overall[2]),
+        'avg_sub_scores': dict(zip(('desire', 'authority', 'revenue', 'timeliness', 'size'),
+                                   map(rounded, overall[3:8]))),
+        'avg_objections': rounded(overall[8]),
+        'meeting_rate': rounded(overall[9]),
+        'meeting_reported_calls': overall[10],
+        'total_distribution': {total: count for total, count in totals},
+        'sub_score_distributions': distributions,
+        'trend': [
+            {'date': day, 'calls': calls, 'avg_total': rounded(avg_total),
+             'meeting_rate': rounded(meeting_rate), 'avg_objections': rounded(avg_objections)}
+            for day, calls, avg_total, meeting_rate, avg_objections in trend
+        ]
+    }
@@ -1,7 +1,16 @@
+import os
 import re
+import time
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from google import genai
 from google.genai import types
-from config import QA_PROMPT
+from pydantic import BaseModel
+from config import QA_PROMPT, GEMINI_MAX_WORKERS
+from .ratelimit import call_with_limits
+from .storage import sha256_file
 
 # ============ GEMINI CLIENT ============
 try:
@@ -9,6 +18,30 @@ try:
 except ValueError:
     gemini_client = None  # Mock mode for local testing
 
+GEMINI_MODEL = 'gemini-2.0-flash'
+
+# Bounded pool so independent Gemini requests (transcript + analysis) run side by side
+_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_WORKERS, thread_name_prefix="gemini")
+
+# How audio reaches Gemini: "inline" (base64 in every request) or "files" (uploaded once via Files API)
+GEMINI_AUDIO_MODE = os.environ.get("GEMINI_AUDIO_MODE", "inline").lower()
+
+# Inline requests are capped by Gemini's request size; Files API uploads go up to 2GB
+INLINE_AUDIO_MAX_BYTES = 25_000_000
+FILES_API_MAX_BYTES = 2_000_000_000
+MAX_AUDIO_BYTES = FILES_API_MAX_BYTES if GEMINI_AUDIO_MODE == "files" else INLINE_AUDIO_MAX_BYTES
+
+# One structured-output call returning transcript segments, scorecard and DARTS sub-scores
+GEMINI_STRUCTURED_OUTPUT = os.environ.get("GEMINI_STRUCTURED_OUTPUT", "off").lower() == "on"
+
+# Longest we wait for an uploaded file to leave PROCESSING
+FILE_PROCESSING_TIMEOUT_SECONDS = 300
+
+# Files API keeps uploads for 48 hours; reuse handles a bit less than that
+FILE_HANDLE_TTL = 47 * 3600
+_file_handles = {}  # sha256 -> (uri, expires_at)
+_file_handles_lock = threading.Lock()
+
 # Prompt for transcript extraction with timestamps and speaker labels
 TRANSCRIPT_PROMPT = """Transcribe this audio with timestamps and speaker labels.
 
@@ -33,72 +66,451 @@ Example (audio with 10 seconds of ringing before speech):
 """
 
 
+STRUCTURED_PROMPT = """Transcribe and evaluate this call in a single pass.
+
+For "transcript": list every utterance in order with "start" as the actual position in the audio file in MM:SS format,
+"speaker" as "Agent" (the sales representative) or "Client" (the prospect/customer), and "text" verbatim.
+Start a new segment every 10-15 seconds or when the speaker changes.
+
+For "sections": one entry per scorecard section, in order, with the section heading as "title"
+and the section body as markdown in "content". Do not include the DARTS section here.
+
+For "darts": the DARTS sub-scores and their total out of 11, with a one-line reason for each.
+
+Evaluate the call using these instructions:
+
+"""
+
+
+class TranscriptSegment(BaseModel):
+    start: str
+    speaker: str
+    text: str
+
+
+class ScorecardSection(BaseModel):
+    title: str
+    content: str
+
+
+class DartsScores(BaseModel):
+    desire: int
+    desire_reason: str
+    authority: int
+    authority_reason: str
+    revenue: int
+    revenue_reason: str
+    timeliness: int
+    timeliness_reason: str
+    size: int
+    size_reason: str
+    total: int
+
+
+class CallAnalysis(BaseModel):
+    transcript: list[TranscriptSegment]
+    sections: list[ScorecardSection]
+    darts: DartsScores
+
+
 def extract_darts_score(text: str) -> str:
     """Extract DARTS score from result text"""
     match = re.search(r'TOTAL DARTS SCORE:\s*\[?(\d+)/11\]?', text)
     return match.group(1) if match else "N/A"
 
 
-def analyze_audio(audio_bytes: bytes, mime_type: str, qualifiers_context: str = "") -> dict:
+def summarize_result(text: str, length: int = 150) -> str:
+    """Short plain-text snippet of a result for history cards (headings and markdown stripped)"""
+    body = re.sub(r'^#+.*$', '', text, flags=re.MULTILINE)
+    plain = re.sub(r'[#*_>`|]+', '', body)
+    return re.sub(r'\s+', ' ', plain).strip()[:length]
+
+
+def record_darts_score(text: str, structured: dict | None = None) -> str:
+    """DARTS total from structured data when available, otherwise parsed from the text"""
+    if structured and structured.get('darts'):
+        return str(structured['darts']['total'])
+    return extract_darts_score(text)
+
+
+DARTS_FIELDS = ('desire', 'authority', 'revenue', 'timeliness', 'size')
+
+
+def extract_call_metrics(text: str, structured: dict | None = None) -> dict:
+    """
+    DARTS sub-scores and total, objection count and meeting outcome for one result.
+    Values are None where the analysis doesn't state them.
+    """
+    metrics = dict.fromkeys((*DARTS_FIELDS, 'total', 'objections', 'meeting_confirmed'))
+
+    if structured and structured.get('darts'):
+        darts = structured['darts']
+        metrics.update({field: darts[field] for field in (*DARTS_FIELDS, 'total')})
+        text = structured_to_markdown(structured)
+    else:
+        for field in DARTS_FIELDS:
+            # "**D = Desire to Meet:** 2 – Reason: ..."
+            match = re.search(rf'\*\*{field[0].upper()}\s*=[^:*]*:\*\*\s*\[?(\d+)', text)
+            if match:
+                metrics[field] = int(match.group(1))
+        total = extract_darts_score(text)
+        metrics['total'] = int(total) if total != "N/A" else None
+
+    # "- Count number of objections: 2 objections" (the other bullets there are techniques)
+    objections = re.search(r'number of objections\W*(\d+|none|no)\b', text, re.IGNORECASE)
+    if objections:
+        count = objections.group(1)
+        metrics['objections'] = int(count) if count.isdigit() else 0
+
+    # "- Meeting Date & Time Confirmed: Done ✓" / "Not Done ✗"
+    meeting = re.search(r'(?:meeting|appointment)\b[^\n:]*\bconfirmed\W*(not done|done|yes|no|✓|✗)',
+                        text, re.IGNORECASE)
+    if meeting:
+        metrics['meeting_confirmed'] = meeting.group(1).lower() in ("done", "yes", "✓")
+    return metrics
+
+
+def structured_to_markdown(structured: dict) -> str:
+    """Render a structured analysis as the same markdown the text mode produces"""
+    parts = [f"## {section['title']}\n\n{section['content']}" for section in structured['sections']]
+    darts = structured['darts']
+    parts.append(
+        "## DARTS SCORE\n\n"
+        f"**D = Desire to Meet:** {darts['desire']} – Reason: {darts['desire_reason']}\n"
+        f"**A = Authority:** {darts['authority']} – Reason: {darts['authority_reason']}\n"
+        f"**R = Revenue Opportunity:** {darts['revenue']} – Reason: {darts['revenue_reason']}\n"
+        f"**T = Timeliness:** {darts['timeliness']} – Reason: {darts['timeliness_reason']}\n"
+        f"**S = Size:** {darts['size']} – Reason: {darts['size_reason']}\n\n"
+        f"**TOTAL DARTS SCORE: [{darts['total']}/11]**"
+    )
+    return "\n\n".join(parts)
+
+
+def structured_to_transcript(structured: dict) -> str:
+    """Render transcript segments as [MM:SS] Speaker: Text lines"""
+    return "\n".join(
+        f"[{segment['start']}] {segment['speaker']}: {segment['text']}"
+        for segment in structured['transcript']
+    )
+
+
+# Rough token estimates for the TPM bucket (corrected from usage_metadata afterwards).
+# Gemini bills audio at 32 tokens/second; assume ~16KB/s (128kbps) recordings.
+AUDIO_BYTES_PER_TOKEN = 500
+EXPECTED_OUTPUT_TOKENS = 2000
+
+
+def estimate_tokens(*texts: str, audio_size: int = 0) -> int:
+    """Estimate prompt plus output tokens for one request"""
+    text_tokens = sum(len(text) for text in texts) // 4
+    return text_tokens + audio_size // AUDIO_BYTES_PER_TOKEN + EXPECTED_OUTPUT_TOKENS
+
+
+def _generate(contents: list, estimated_tokens: int, config: types.GenerateContentConfig | None = None):
+    """generate_content behind the shared rate limiter with retry/backoff"""
+    return call_with_limits(
+        lambda: gemini_client.models.generate_content(model=GEMINI_MODEL, contents=contents, config=config),
+        estimated_tokens
+    )
+
+
+def _generate_stream(contents: list, estimated_tokens: int, on_chunk) -> str:
+    """
+    Stream generate_content output, calling on_chunk(text) for each piece.
+    The first chunk is fetched under the rate limiter so quota errors are retried.
+    Returns the full text.
+    """
+    def start():
+        stream = gemini_client.models.generate_content_stream(model=GEMINI_MODEL, contents=contents)
+        return stream, next(stream, None)
+
+    started = time.perf_counter()
+    stream, first = call_with_limits(start, estimated_tokens)
+    print(f"[TIMING] first chunk after {time.perf_counter() - started:.2f}s")
+
+    parts = []
+    for chunk in itertools.chain([first] if first is not None else [], stream):
+        if chunk.text:
+            parts.append(chunk.text)
+            on_chunk(chunk.text)
+    return "".join(parts)
+
+
+def upload_audio_file(audio_path: Path, mime_type: str, digest: str | None = None) -> str:
+    """
+    Upload an audio file to the Gemini Files API once and return its URI.
+    The file is streamed from disk, never read whole.
+    Repeat submissions of the same recording (same sha256_file digest, computed
+    here unless passed in) reuse the existing upload.
+    In mock mode a local stand-in URI is returned instead.
+    """
+    digest = digest or sha256_file(audio_path)
+    now = time.time()
+    with _file_handles_lock:
+        cached = _file_handles.get(digest)
+        if cached and cached[1] > now:
+            return cached[0]
+
+    if gemini_client is None:
+        uri = f"mock://files/{digest}"
+    else:
+        uploaded = call_with_limits(
+            lambda: gemini_client.files.upload(
+                file=audio_path,
+                config=types.UploadFileConfig(mime_type=mime_type, display_name=digest[:16])
+            ),
+            rate_limited=False
+        )
+        # Audio is usually ACTIVE right away, but wait out any processing (within reason)
+        deadline = time.monotonic() + FILE_PROCESSING_TIMEOUT_SECONDS
+        while uploaded.state and uploaded.state.name == "PROCESSING":
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Gemini is still processing the audio after "
+                                   f"{FILE_PROCESSING_TIMEOUT_SECONDS}s, please try again")
+            time.sleep(1)
+            uploaded = gemini_client.files.get(name=uploaded.name)
+        if uploaded.state and uploaded.state.name == "FAILED":
+            raise RuntimeError("Gemini could not process the audio file")
+        uri = uploaded.uri
+
+    with _file_handles_lock:
+        _file_handles[digest] = (uri, now + FILE_HANDLE_TTL)
+    return uri
+
+
+def get_audio_part(audio_path: Path, mime_type: str, digest: str | None = None) -> types.Part:
+    """Build the audio part for a prompt, inline or as a Files API reference"""
+    if GEMINI_AUDIO_MODE == "files":
+        uri = upload_audio_file(audio_path, mime_type, digest)
+        return types.Part.from_uri(file_uri=uri, mime_type=mime_type)
+    # Inline requests carry the bytes anyway, and are capped at INLINE_AUDIO_MAX_BYTES
+    return types.Part.from_bytes(data=audio_path.read_bytes(), mime_type=mime_type)
+
+
+def _timed_generate(contents: list, estimated_tokens: int, on_chunk=None) -> tuple[str, float]:
+    """Run a single generate_content call, streamed if on_chunk is given. Returns (text, elapsed seconds)."""
+    start = time.perf_counter()
+    if on_chunk:
+        text = _generate_stream(contents, estimated_tokens, on_chunk)
+    else:
+        text = _generate(contents, estimated_tokens).text
+    return text, time.perf_counter() - start
+
+
+def analyze_audio(audio_path: Path, mime_type: str, qualifiers_context: str = "", on_chunk=None,
+                  digest: str | None = None) -> dict:
     """
-    Send audio to Gemini for transcription and analysis.
-    Returns dict with 'analysis' and 'transcript' keys.
+    Send an audio file to Gemini for transcription and analysis.
+    Both requests are in flight together, so latency is roughly the slower of the two.
+    If on_chunk is given, the analysis is streamed through it as it is generated.
+    digest is the file's sha256_file digest, if already known (saves rehashing for the Files API).
+    Returns dict with 'analysis', 'transcript' and 'timings' keys.
     """
     if gemini_client is None:
+        if on_chunk:
+            on_chunk(_mock_analysis("Audio file"))
         return {
             'analysis': _mock_analysis("Audio file"),
-            'transcript': _mock_transcript()
+            'transcript': _mock_transcript(),
+            'timings': {}
         }
 
-    audio_part = types.Part.from_bytes(data=audio_bytes, mime_type=mime_type)
+    from .audio import probe_duration, LONG_CALL_SECONDS
+    duration = probe_duration(audio_path)
+    # Over the request limit (e.g. ffmpeg couldn't shrink it) it has to go in segments too
+    too_large = audio_path.stat().st_size > MAX_AUDIO_BYTES
+    if too_large and not duration:
+        raise ValueError(f"Audio file too large (max {MAX_AUDIO_BYTES // 1_000_000}MB)")
+    if duration and (duration > LONG_CALL_SECONDS or too_large):
+        return analyze_long_audio(audio_path, mime_type, duration, qualifiers_context, on_chunk)
+
+    if GEMINI_STRUCTURED_OUTPUT:
+        result = analyze_audio_structured(audio_path, mime_type, qualifiers_context, on_chunk, digest)
+        if result:
+            return result
+
+    # Uploaded (or inlined) once and shared by both prompts
+    audio_part = get_audio_part(audio_path, mime_type, digest)
+    audio_size = audio_path.stat().st_size
+    full_prompt = QA_PROMPT + qualifiers_context
 
-    # Get transcript with timestamps and speaker labels
-    transcript_response = gemini_client.models.generate_content(
-        model='gemini-2.0-flash',
-        contents=[TRANSCRIPT_PROMPT, audio_part]
+    start = time.perf_counter()
+    transcript_future = _executor.submit(
+        _timed_generate, [TRANSCRIPT_PROMPT, audio_part],
+        estimate_tokens(TRANSCRIPT_PROMPT, audio_size=audio_size)
+    )
+    analysis_future = _executor.submit(
+        _timed_generate, [full_prompt, audio_part],
+        estimate_tokens(full_prompt, audio_size=audio_size), on_chunk
     )
-    transcript = transcript_response.text
 
-    # Get QA analysis
-    full_prompt = QA_PROMPT + qualifiers_context
-    analysis_response = gemini_client.models.generate_content(
-        model='gemini-2.0-flash',
-        contents=[full_prompt, audio_part]
+    transcript, transcript_secs = transcript_future.result()
+    analysis, analysis_secs = analysis_future.result()
+    wall_secs = time.perf_counter() - start
+
+    print(f"[TIMING] analyze_audio: transcript={transcript_secs:.2f}s "
+          f"analysis={analysis_secs:.2f}s wall={wall_secs:.2f}s")
+
+    return {
+        'analysis': analysis,
+        'transcript': transcript,
+        'timings': {
+            'transcript': transcript_secs,
+            'analysis': analysis_secs,
+            'wall': wall_secs
+        }
+    }
+
+
+def analyze_audio_structured(audio_path: Path, mime_type: str, qualifiers_context: str = "",
+                             on_chunk=None, digest: str | None = None) -> dict | None:
+    """
+    Transcribe and analyze audio in one call with a JSON response schema.
+    Returns the analyze_audio dict plus 'structured' (transcript segments, sections, DARTS),
+    or None when the response doesn't match the schema (analyze_audio then makes the two calls).
+    JSON can't be shown half-written, so on_chunk only receives the finished analysis.
+    """
+    prompt = STRUCTURED_PROMPT + QA_PROMPT + qualifiers_context
+    config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=CallAnalysis
     )
-    analysis = analysis_response.text
+
+    start = time.perf_counter()
+    response = _generate(
+        [prompt, get_audio_part(audio_path, mime_type, digest)],
+        estimate_tokens(prompt, audio_size=audio_path.stat().st_size),
+        config
+    )
+    wall_secs = time.perf_counter() - start
+    if response.parsed is None:
+        print(f"[WARN] Structured response didn't match the schema after {wall_secs:.2f}s, "
+              f"falling back to transcript + analysis calls")
+        return None
+    structured = response.parsed.model_dump()
+    print(f"[TIMING] analyze_audio (structured): wall={wall_secs:.2f}s")
+
+    analysis = structured_to_markdown(structured)
+    if on_chunk:
+        on_chunk(analysis)
+
+    return {
+        'analysis': analysis,
+        'transcript': structured_to_transcript(structured),
+        'structured': structured,
+        'timings': {'wall': wall_secs}
+    }
+
+
+def _to_seconds(minutes: str, seconds: str) -> int:
+    return int(minutes) * 60 + int(seconds)
+
+
+def _format_timestamp(total_seconds: int) -> str:
+    """[MM:SS] body; minutes keep counting past 59 so the transcript parser still matches"""
+    return f"{total_seconds // 60}:{total_seconds % 60:02d}"
+
+
+def stitch_transcripts(parts: list, overlap_seconds: int) -> str:
+    """
+    Merge per-segment transcripts into one transcript with global timestamps.
+    parts is a list of (segment_offset_seconds, transcript_text) in order.
+    Each overlap is split at its midpoint: lines before it come from the earlier
+    segment, lines after it from the later one. Repeats across the seam are dropped.
+    Lines without a timestamp (wrapped or continued speech) join the line before them.
+    """
+    lines = []
+    for i, (offset, text) in enumerate(parts):
+        own_from = offset + overlap_seconds / 2 if i > 0 else 0
+        own_until = parts[i + 1][0] + overlap_seconds / 2 if i + 1 < len(parts) else float('inf')
+
+        continues = False  # whether the last timestamped line of this segment was kept
+        for line in text.splitlines():
+            match = re.match(r'\s*\[(\d+):(\d{2})\]\s*(\w+):\s*(.*)', line)
+            if not match:
+                if continues and line.strip():
+                    lines[-1][2] = f"{lines[-1][2]} {line.strip()}".lstrip()
+                continue
+            at = offset + _to_seconds(match.group(1), match.group(2))
+            speaker, said = match.group(3), match.group(4).strip()
+            continues = False
+            if not own_from <= at < own_until:
+                continue
+            if said and lines and lines[-1][1] == speaker and lines[-1][2] == said:
+                continue
+            # Kept even if empty for now: what was said may be on the next line
+            lines.append([at, speaker, said])
+            continues = True
+
+    return "\n".join(f"[{_format_timestamp(at)}] {speaker}: {said}" for at, speaker, said in lines if said)
+
+
+def analyze_long_audio(audio_path: Path, mime_type: str, duration: float,
+                       qualifiers_context: str = "", on_chunk=None) -> dict:
+    """
+    Transcribe a long call as overlapping segments in parallel, stitch the
+    transcript, then run the QA analysis once on the stitched text.
+    """
+    from .audio import split_audio, SEGMENT_OVERLAP_SECONDS
+
+    start = time.perf_counter()
+    # Each segment is sent as soon as it is cut, while ffmpeg works on the next
+    offsets, futures = [], []
+    for offset, segment in split_audio(audio_path, duration):
+        offsets.append(offset)
+        futures.append(_executor.submit(
+            _timed_generate,
+            [TRANSCRIPT_PROMPT, types.Part.from_bytes(data=segment, mime_type="audio/ogg")],
+            estimate_tokens(TRANSCRIPT_PROMPT, audio_size=len(segment))
+        ))
+    results = [future.result() for future in futures]
+    transcript = stitch_transcripts(
+        [(offset, text) for offset, (text, _) in zip(offsets, results)],
+        SEGMENT_OVERLAP_SECONDS
+    )
+    transcript_secs = time.perf_counter() - start
+
+    analysis = analyze_transcript(transcript, qualifiers_context, on_chunk)
+    wall_secs = time.perf_counter() - start
+
+    print(f"[TIMING] analyze_long_audio: {len(offsets)} segments over {duration:.0f}s, "
+          f"slowest segment={max(secs for _, secs in results):.2f}s "
+          f"transcript={transcript_secs:.2f}s wall={wall_secs:.2f}s")
 
     return {
         'analysis': analysis,
-        'transcript': transcript
+        'transcript': transcript,
+        'timings': {
+            'transcript': transcript_secs,
+            'analysis': wall_secs - transcript_secs,
+            'wall': wall_secs
+        }
     }
 
 
-def analyze_transcript(transcript: str, qualifiers_context: str = "") -> str:
-    """Send transcript text to Gemini for analysis"""
+def analyze_transcript(transcript: str, qualifiers_context: str = "", on_chunk=None) -> str:
+    """Send transcript text to Gemini for analysis, streamed through on_chunk if given"""
     if gemini_client is None:
+        if on_chunk:
+            on_chunk(_mock_analysis("Transcript"))
         return _mock_analysis("Transcript")
 
-    full_prompt = QA_PROMPT + qualifiers_context
-    response = gemini_client.models.generate_content(
-        model='gemini-2.0-flash',
-        contents=[full_prompt + "\n\n## CALL TRANSCRIPT:\n" + transcript]
-    )
-    return response.text
+    full_prompt = QA_PROMPT + qualifiers_context + "\n\n## CALL TRANSCRIPT:\n" + transcript
+    text, _ = _timed_generate([full_prompt], estimate_tokens(full_prompt), on_chunk)
+    return text
 
 
-def reanalyze_text(edited_text: str) -> str:
-    """Re-analyze edited text using Gemini"""
+def reanalyze_text(edited_text: str, on_chunk=None) -> str:
+    """Re-analyze edited text using Gemini, streamed through on_chunk if given"""
     if gemini_client is None:
-        return edited_text + "\n\n---\n*Re-analyzed (MOCK MODE - no API key)*"
-
-    response = gemini_client.models.generate_content(
-        model='gemini-2.0-flash',
-        contents=[
-            "Re-analyze and correct this QA call analysis based on any edits made. Maintain the same structured format:\n\n",
-            edited_text
-        ]
-    )
-    return response.text
+        result = edited_text + "\n\n---\n*Re-analyzed (MOCK MODE - no API key)*"
+        if on_chunk:
+            on_chunk(result)
+        return result
+
+    prompt = "Re-analyze and correct this QA call analysis based on any edits made. Maintain the same structured format:\n\n"
+    text, _ = _timed_generate([prompt, edited_text], estimate_tokens(prompt, edited_text), on_chunk)
+    return text
 
 
 def _mock_analysis(source_name: str) -> str:
@@ -0,0 +1,385 @@
+import json
+import time
+import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from config import JOB_WORKERS, BATCH_CONCURRENCY
+from .database import connection
+from .pipeline import run_pipeline, run_reanalysis, extract_zip_audio
+
+# Background workers running the analysis pipeline
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+# Batch uploads get their own pool so a big batch can't starve single uploads
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch")
+
+# Finished jobs are pruned after this many days
+JOB_RETENTION_DAYS = 7
+
+# Running jobs bump updated_at this often; one silent for JOB_STALE_SECONDS lost its
+# worker (crash or restart) and may be claimed by any process
+JOB_HEARTBEAT_SECONDS = 30
+JOB_STALE_SECONDS = 120
+
+# Uploaded audio waits here until its job finishes (survives restarts)
+JOB_INPUT_DIR = Path(__file__).parent.parent / ".job_inputs"
+JOB_INPUT_DIR.mkdir(exist_ok=True)
+
+# Uploads are copied to disk in pieces this size, so a request never holds a whole file
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+_COLUMNS = ("id", "kind", "status", "stage", "filename", "mime_type", "input_path",
+            "transcript", "qualifiers_context", "result_json", "error",
+            "batch_id", "created_at", "updated_at")
+
+# Spooled inputs with no live job are deleted after this long (a request may still be submitting)
+ORPHAN_INPUT_SECONDS = 3600
+
+# Stage and streamed analysis text for jobs running in this process (job_id -> {'text', 'stage', 'finished'})
+_partials = {}
+_partials_lock = threading.Lock()
+
+
+def _memory_mb() -> dict:
+    """Current and peak resident set size of this process in MB"""
+    stats = {}
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    stats[name] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    if "VmHWM" not in stats:
+        # Not Linux: ru_maxrss is KB here (bytes on macOS), and there is no current figure
+        try:
+            import resource
+            stats["VmHWM"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        except ImportError:
+            pass  # Windows
+    return {'rss_mb': stats.get("VmRSS"), 'peak_rss_mb': stats.get("VmHWM")}
+
+
+def get_memory_stats() -> dict:
+    """Process memory and the job input spool, for /api/stats"""
+    spooled = [path.stat().st_size for path in JOB_INPUT_DIR.iterdir() if path.is_file()]
+    return {
+        **_memory_mb(),
+        'spooled_files': len(spooled),
+        'spooled_mb': round(sum(spooled) / 1_000_000, 1),
+        'upload_chunk_bytes': UPLOAD_CHUNK_BYTES
+    }
+
+
+async def spool_upload(upload, max_bytes: int) -> Path:
+    """
+    Copy an UploadFile into a new job input file UPLOAD_CHUNK_BYTES at a time,
+    enforcing max_bytes as it goes. Returns the file path for submit_job.
+    The request body has already been received by then (Starlette spools it while
+    parsing the form), so the limit only saves the copy and the work after it.
+    """
+    too_large = ValueError(f"{upload.filename} is too large (max {max_bytes // 1_000_000}MB)")
+    # Starlette knows the size once the form is parsed; don't copy what will be rejected
+    if (getattr(upload, 'size', None) or 0) > max_bytes:
+        raise too_large
+
+    path = JOB_INPUT_DIR / uuid.uuid4().hex
+    size = 0
+    try:
+        with open(path, 'wb') as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise too_large
+                out.write(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
+
+
+async def spool_zip_upload(upload, max_file_bytes: int) -> list:
+    """Unpack the audio files in an uploaded zip into job input files: [(filename, path, mime_type)]"""
+    return await asyncio.to_thread(extract_zip_audio, upload.file, max_file_bytes, JOB_INPUT_DIR)
+
+
+def submit_job(filename: str, qualifiers_context: str = "", audio_path: Path | None = None,
+               mime_type: str = "", transcript: str = "", batch_id: str | None = None,
+               kind: str = "call") -> str:
+    """
+    Queue a call for background analysis. Returns the job id immediately.
+    audio_path is a file from spool_upload; the job deletes it when it finishes.
+    kind is "call" (audio or pasted transcript) or "reanalyze" (transcript holds the edited result).
+    """
+    job_id = uuid.uuid4().hex
+    input_path = str(audio_path) if audio_path is not None else ""
+
+    now = time.time()
+    with connection() as conn:
+        conn.execute(
+            """INSERT INTO jobs
+               (id, kind, status, stage, filename, mime_type, input_path, transcript,
+                qualifiers_context, batch_id, created_at, updated_at)
+               VALUES (?, ?, 'queued', 'Queued', ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (job_id, kind, filename, mime_type, input_path, transcript, qualifiers_context, batch_id, now, now)
+        )
+        conn.commit()
+
+    _executor_for(batch_id).submit(_run_job, job_id)
+    return job_id
+
+
+def submit_batch(files: list, qualifiers_context: str = "") -> str:
+    """
+    Queue many audio files sharing one qualifiers block.
+    files is a list of (filename, spooled_path, mime_type). Returns the batch id.
+    """
+    batch_id = uuid.uuid4().hex
+    for filename, audio_path, mime_type in files:
+        submit_job(filename, qualifiers_context, audio_path=audio_path,
+                   mime_type=mime_type, batch_id=batch_id)
+    return batch_id
+
+
+def get_batch_jobs(batch_id: str) -> list:
+    """Get every job in a batch, in submission order"""
+    try:
+        with connection() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE batch_id = ? ORDER BY created_at",
+                (batch_id,)
+            ).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(zip(_COLUMNS, row))
+            job['result'] = json.loads(job['result_json']) if job['result_json'] else None
+            jobs.append(job)
+        return jobs
+    except Exception as e:
+        print(f"[ERROR] get_batch_jobs: {e}")
+        return []
+
+
+def _executor_for(batch_id: str | None) -> ThreadPoolExecutor:
+    return _batch_executor if batch_id else _executor
+
+
+def get_job(job_id: str) -> dict | None:
+    """Get job state, with the pipeline result decoded once it is done"""
+    try:
+        with connection() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        job = dict(zip(_COLUMNS, row))
+        job['result'] = json.loads(job['result_json']) if job['result_json'] else None
+        return job
+    except Exception as e:
+        print(f"[ERROR] get_job: {e}")
+        return None
+
+
+def get_job_partial(job_id: str) -> dict | None:
+    """
+    Current stage and analysis text streamed so far for a job running in this process.
+    Returns {'text', 'stage', 'finished'} or None if this process isn't running the job.
+    """
+    with _partials_lock:
+        partial = _partials.get(job_id)
+        return dict(partial) if partial else None
+
+
+def _set_partial_stage(job_id: str, stage: str):
+    with _partials_lock:
+        _partials[job_id]['stage'] = stage
+
+
+def _append_partial(job_id: str, text: str):
+    with _partials_lock:
+        _partials[job_id]['text'] += text
+
+
+def _finish_partial(job_id: str):
+    """Mark the stream finished; the entry lingers briefly for late readers"""
+    with _partials_lock:
+        _partials[job_id]['finished'] = True
+
+    def drop():
+        with _partials_lock:
+            _partials.pop(job_id, None)
+    timer = threading.Timer(60, drop)
+    timer.daemon = True
+    timer.start()
+
+
+def _update_job(job_id: str, **fields):
+    """Update job columns and bump updated_at"""
+    fields['updated_at'] = time.time()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with connection() as conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        conn.commit()
+
+
+def _claim_job(job_id: str) -> bool:
+    """Move a queued job to running; False if another worker got there first"""
+    with connection() as conn:
+        claimed = conn.execute(
+            "UPDATE jobs SET status = 'running', stage = 'Starting', updated_at = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id)
+        ).rowcount
+        conn.commit()
+    return claimed == 1
+
+
+def _heartbeat(job_id: str, stop: threading.Event):
+    """Keep a running job's updated_at fresh so other processes don't think it was abandoned"""
+    while not stop.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            _update_job(job_id)
+        except Exception as e:
+            print(f"[WARN] job {job_id} heartbeat: {e}")
+
+
+def _run_job(job_id: str):
+    """Worker entry point: run the pipeline for one job and record the outcome"""
+    job = get_job(job_id)
+    if not job:
+        print(f"[WARN] job {job_id} could not be loaded, not run")
+        return
+    try:
+        if not _claim_job(job_id):
+            print(f"[INFO] job {job_id} was claimed by another worker, skipped")
+            return
+    except Exception as e:
+        print(f"[ERROR] job {job_id} claim: {e}")
+        return
+
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stop_heartbeat),
+                     name="job-heartbeat", daemon=True).start()
+
+    with _partials_lock:
+        _partials[job_id] = {'text': "", 'stage': 'Starting', 'finished': False}
+
+    def on_stage(stage):
+        _set_partial_stage(job_id, stage)
+        _update_job(job_id, stage=stage)
+
+    def on_chunk(text):
+        _append_partial(job_id, text)
+
+    memory_before = _memory_mb()
+    try:
+        if job['kind'] == 'reanalyze':
+            result = run_reanalysis(job['transcript'] or "", on_stage=on_stage, on_chunk=on_chunk)
+        else:
+            audio_path = None
+            if job['input_path']:
+                audio_path = Path(job['input_path'])
+                if not audio_path.exists():
+                    raise RuntimeError("Uploaded audio is no longer available, please resubmit")
+
+            result = run_pipeline(
+                job['filename'], job['qualifiers_context'] or "",
+                audio_path=audio_path, mime_type=job['mime_type'] or "",
+                transcript=job['transcript'] or "",
+                on_stage=on_stage, on_chunk=on_chunk
+            )
+        _update_job(job_id, status='done', stage='Done', result_json=json.dumps(result))
+    except Exception as e:
+        print(f"[ERROR] job {job_id}: {e}")
+        try:
+            _update_job(job_id, status='error', stage='Failed', error=str(e))
+        except Exception as update_error:
+            print(f"[ERROR] job {job_id} status update: {update_error}")
+    finally:
+        stop_heartbeat.set()
+        _finish_partial(job_id)
+        if job['input_path']:
+            Path(job['input_path']).unlink(missing_ok=True)
+        memory_after = _memory_mb()
+        print(f"[MEMORY] job {job_id}: rss {memory_before['rss_mb']} -> {memory_after['rss_mb']}MB, "
+              f"process peak {memory_after['peak_rss_mb']}MB")
+
+
+def _prune_orphan_inputs(live_inputs: set):
+    """Delete spooled uploads left behind by a crash between spooling and queueing"""
+    cutoff = time.time() - ORPHAN_INPUT_SECONDS
+    for path in JOB_INPUT_DIR.iterdir():
+        try:
+            if str(path) not in live_inputs and path.stat().st_mtime < cutoff:
+                path.unlink()
+                print(f"[INFO] Removed orphaned upload {path.name}")
+        except OSError as e:
+            print(f"[WARN] Could not remove {path.name}: {e}")
+
+
+def _requeue_stale_jobs() -> int:
+    """Claim running jobs whose worker stopped heartbeating and queue them here. Returns how many."""
+    now = time.time()
+    cutoff = now - JOB_STALE_SECONDS
+    claimed = []
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT id, batch_id FROM jobs WHERE status = 'running' AND updated_at < ? ORDER BY created_at",
+            (cutoff,)
+        ).fetchall()
+        for job_id, batch_id in rows:
+            # Only one process wins each job, even if several sweep at once
+            if conn.execute(
+                """UPDATE jobs SET status = 'queued', stage = 'Queued', updated_at = ?
+                   WHERE id = ? AND status = 'running' AND updated_at < ?""",
+                (now, job_id, cutoff)
+            ).rowcount == 1:
+                claimed.append((job_id, batch_id))
+        conn.commit()
+    for job_id, batch_id in claimed:
+        _executor_for(batch_id).submit(_run_job, job_id)
+    return len(claimed)
+
+
+def _sweep_stale_jobs():
+    """Requeue abandoned running jobs every JOB_STALE_SECONDS"""
+    while True:
+        time.sleep(JOB_STALE_SECONDS)
+        try:
+            if count := _requeue_stale_jobs():
+                print(f"[INFO] Requeued {count} abandoned job(s)")
+        except Exception as e:
+            print(f"[ERROR] requeue stale jobs: {e}")
+
+
+def resume_pending_jobs():
+    """
+    Re-queue jobs interrupted by a restart and prune old finished jobs.
+    Safe with several processes on one database: queued jobs are claimed when they start,
+    and running jobs are only taken over once their worker stops heartbeating
+    (checked again every JOB_STALE_SECONDS, for jobs interrupted just before this start).
+    """
+    try:
+        with connection() as conn:
+            cutoff = time.time() - JOB_RETENTION_DAYS * 86400
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'error') AND updated_at < ?", (cutoff,))
+            conn.commit()
+
+            rows = conn.execute(
+                "SELECT id, batch_id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+            ).fetchall()
+            live_inputs = {row[0] for row in conn.execute(
+                "SELECT input_path FROM jobs WHERE status IN ('queued', 'running') AND input_path != ''"
+            ).fetchall()}
+        _prune_orphan_inputs(live_inputs)
+        for job_id, batch_id in rows:
+            _executor_for(batch_id).submit(_run_job, job_id)
+        resumed = len(rows) + _requeue_stale_jobs()
+        if resumed:
+            print(f"[INFO] Resumed {resumed} pending job(s)")
+    except Exception as e:
+        print(f"[ERROR] resume_pending_jobs: {e}")
+    threading.Thread(target=_sweep_stale_jobs, name="job-sweep", daemon=True).start()
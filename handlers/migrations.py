@@ -0,0 +1,362 @@
+import json
+import time
+
+# Every migration must be safe to re-run: databases created before versioning
+# already have some of these tables and columns, and two processes starting at
+# once may both apply the same step.
+
+
+def _add_column_if_missing(conn, table: str, column: str, definition: str):
+    """Add a column to an existing table (CREATE TABLE IF NOT EXISTS won't)"""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _baseline(conn):
+    """Tables as they existed before schema versioning"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS qa_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT UNIQUE NOT NULL,
+            filename TEXT NOT NULL,
+            full_result TEXT,
+            transcript TEXT,
+            audio_url TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    _add_column_if_missing(conn, "qa_results", "structured_json", "TEXT")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            cache_key TEXT PRIMARY KEY,
+            analysis TEXT NOT NULL,
+            transcript TEXT,
+            size_bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+    """)
+    _add_column_if_missing(conn, "analysis_cache", "structured_json", "TEXT")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            stage TEXT,
+            filename TEXT NOT NULL,
+            mime_type TEXT,
+            input_path TEXT,
+            transcript TEXT,
+            qualifiers_context TEXT,
+            result_json TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    _add_column_if_missing(conn, "jobs", "batch_id", "TEXT")
+    _add_column_if_missing(conn, "jobs", "kind", "TEXT NOT NULL DEFAULT 'call'")
+
+
+def _listing_columns(conn, batch_size: int = 200):
+    """Summary and DARTS total stored per record so history never reads full_result"""
+    from .gemini import record_darts_score, summarize_result
+
+    _add_column_if_missing(conn, "qa_results", "summary", "TEXT")
+    _add_column_if_missing(conn, "qa_results", "darts_score", "TEXT")
+
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            """SELECT id, full_result, structured_json FROM qa_results
+               WHERE id > ? AND summary IS NULL ORDER BY id LIMIT ?""",
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return
+        for row_id, full_result, structured_json in rows:
+            structured = json.loads(structured_json) if structured_json else None
+            conn.execute(
+                "UPDATE qa_results SET summary = ?, darts_score = ? WHERE id = ?",
+                (summarize_result(full_result or ""), record_darts_score(full_result or "", structured), row_id)
+            )
+        conn.commit()
+        last_id = rows[-1][0]
+
+
+def _hot_query_indexes(conn):
+    """Indexes behind the history listing, job polling and cache eviction queries"""
+    # History pages: ORDER BY created_at DESC, id DESC with a (created_at, id) keyset
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_qa_results_created ON qa_results (created_at, id)")
+    # Batch progress page and restart recovery
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+    # TTL expiry and LRU eviction
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_created ON analysis_cache (created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_used ON analysis_cache (last_used_at)")
+
+
+def _search_index(conn, batch_size: int = 200):
+    """Contentless FTS5 index over filename, analysis and transcript, filled from existing rows"""
+    from .database import _unpack_text
+
+    # Contentless: the text already lives (compressed) in qa_results, the index only keeps postings
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS qa_results_fts USING fts5(
+            filename, full_result, transcript,
+            content='', tokenize='porter unicode61'
+        )
+    """)
+    conn.execute("INSERT INTO qa_results_fts (qa_results_fts) VALUES ('delete-all')")
+
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            """SELECT id, filename, full_result, transcript FROM qa_results
+               WHERE id > ? ORDER BY id LIMIT ?""",
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return
+        conn.executemany(
+            "INSERT INTO qa_results_fts (rowid, filename, full_result, transcript) VALUES (?, ?, ?, ?)",
+            [(row_id, filename, _unpack_text(full_result) or "", _unpack_text(transcript) or "")
+             for row_id, filename, full_result, transcript in rows]
+        )
+        conn.commit()
+        last_id = rows[-1][0]
+
+
+def _call_metrics(conn, batch_size: int = 200):
+    """Typed DARTS sub-score, objection and meeting columns, parsed from existing results"""
+    from .database import _unpack_text
+    from .gemini import extract_call_metrics
+
+    for column in ("darts_desire", "darts_authority", "darts_revenue", "darts_timeliness", "darts_size",
+                   "darts_total", "objection_count", "meeting_confirmed"):
+        _add_column_if_missing(conn, "qa_results", column, "INTEGER")
+    # Rows with metrics_parsed = 0 still need the backfill (a NULL score can mean "not stated")
+    _add_column_if_missing(conn, "qa_results", "metrics_parsed", "INTEGER NOT NULL DEFAULT 0")
+
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            """SELECT id, full_result, structured_json FROM qa_results
+               WHERE id > ? AND metrics_parsed = 0 ORDER BY id LIMIT ?""",
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return
+        for row_id, full_result, structured_json in rows:
+            structured = json.loads(structured_json) if structured_json else None
+            metrics = extract_call_metrics(_unpack_text(full_result) or "", structured)
+            conn.execute(
+                """UPDATE qa_results SET darts_desire = ?, darts_authority = ?, darts_revenue = ?,
+                   darts_timeliness = ?, darts_size = ?, darts_total = ?, objection_count = ?,
+                   meeting_confirmed = ?, metrics_parsed = 1 WHERE id = ?""",
+                (metrics['desire'], metrics['authority'], metrics['revenue'], metrics['timeliness'],
+                 metrics['size'], metrics['total'], metrics['objections'], metrics['meeting_confirmed'],
+                 row_id)
+            )
+        conn.commit()
+        last_id = rows[-1][0]
+
+
+_QA_RESULTS_COLUMNS = (
+    "id", "timestamp", "filename", "full_result", "transcript", "audio_url", "created_at",
+    "structured_json", "summary", "darts_score", "darts_desire", "darts_authority", "darts_revenue",
+    "darts_timeliness", "darts_size", "darts_total", "objection_count", "meeting_confirmed",
+    "metrics_parsed"
+)
+
+
+def _id_keyed_results(conn):
+    """Drop UNIQUE(timestamp): records are addressed by id, and two saves in one second must both land"""
+    table_sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'qa_results'"
+    ).fetchone()[0]
+    if "UNIQUE" in table_sql.upper():
+        # SQLite can't drop a constraint in place: rebuild the table, keeping every id
+        columns = ", ".join(_QA_RESULTS_COLUMNS)
+        conn.execute("DROP TABLE IF EXISTS qa_results_rebuild")
+        conn.execute("""
+            CREATE TABLE qa_results_rebuild (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                full_result TEXT,
+                transcript TEXT,
+                audio_url TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                structured_json TEXT,
+                summary TEXT,
+                darts_score TEXT,
+                darts_desire INTEGER,
+                darts_authority INTEGER,
+                darts_revenue INTEGER,
+                darts_timeliness INTEGER,
+                darts_size INTEGER,
+                darts_total INTEGER,
+                objection_count INTEGER,
+                meeting_confirmed INTEGER,
+                metrics_parsed INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute(f"INSERT INTO qa_results_rebuild ({columns}) SELECT {columns} FROM qa_results")
+        conn.execute("DROP TABLE qa_results")
+        conn.execute("ALTER TABLE qa_results_rebuild RENAME TO qa_results")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_qa_results_created ON qa_results (created_at, id)")
+    # Old /result/<timestamp> links still resolve
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_qa_results_timestamp ON qa_results (timestamp)")
+
+
+def _pending_uploads(conn):
+    """Records saved while their audio upload kept failing, with the local copy to retry from"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pending_uploads (
+            record_id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+
+
+def _audio_blob_refcounts(conn):
+    """
+    How many qa_results rows point at each stored audio blob. Triggers keep the
+    counts in step with every insert, audio_url change and delete, so a blob
+    whose count reaches zero can be removed from storage.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS audio_blobs (
+            blob_name TEXT PRIMARY KEY,
+            refcount INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS qa_results_blob_insert AFTER INSERT ON qa_results
+        WHEN COALESCE(NEW.audio_url, '') != ''
+        BEGIN
+            INSERT INTO audio_blobs (blob_name, refcount) VALUES (NEW.audio_url, 1)
+            ON CONFLICT (blob_name) DO UPDATE SET refcount = refcount + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS qa_results_blob_update AFTER UPDATE OF audio_url ON qa_results
+        WHEN COALESCE(OLD.audio_url, '') != COALESCE(NEW.audio_url, '')
+        BEGIN
+            UPDATE audio_blobs SET refcount = refcount - 1 WHERE blob_name = OLD.audio_url;
+            INSERT INTO audio_blobs (blob_name, refcount)
+            SELECT NEW.audio_url, 1 WHERE COALESCE(NEW.audio_url, '') != ''
+            ON CONFLICT (blob_name) DO UPDATE SET refcount = refcount + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS qa_results_blob_delete AFTER DELETE ON qa_results
+        WHEN COALESCE(OLD.audio_url, '') != ''
+        BEGIN
+            UPDATE audio_blobs SET refcount = refcount - 1 WHERE blob_name = OLD.audio_url;
+        END
+    """)
+    # Recount from scratch (also correct when re-run)
+    conn.execute("DELETE FROM audio_blobs")
+    conn.execute("""
+        INSERT INTO audio_blobs (blob_name, refcount)
+        SELECT audio_url, COUNT(*) FROM qa_results WHERE COALESCE(audio_url, '') != '' GROUP BY audio_url
+    """)
+
+
+def _reparse_call_metrics(conn):
+    """Redo the migration 5 backfill: objection counts and meeting outcomes were misread"""
+    conn.execute("UPDATE qa_results SET metrics_parsed = 0")
+    conn.commit()
+    _call_metrics(conn)
+
+
+def _original_audio_column(conn):
+    """Blob name of the uncompressed upload kept with AUDIO_KEEP_ORIGINAL, counted in audio_blobs too"""
+    _add_column_if_missing(conn, "qa_results", "original_audio_url", "TEXT")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS qa_results_original_blob_insert AFTER INSERT ON qa_results
+        WHEN COALESCE(NEW.original_audio_url, '') != ''
+        BEGIN
+            INSERT INTO audio_blobs (blob_name, refcount) VALUES (NEW.original_audio_url, 1)
+            ON CONFLICT (blob_name) DO UPDATE SET refcount = refcount + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS qa_results_original_blob_update AFTER UPDATE OF original_audio_url ON qa_results
+        WHEN COALESCE(OLD.original_audio_url, '') != COALESCE(NEW.original_audio_url, '')
+        BEGIN
+            UPDATE audio_blobs SET refcount = refcount - 1 WHERE blob_name = OLD.original_audio_url;
+            INSERT INTO audio_blobs (blob_name, refcount)
+            SELECT NEW.original_audio_url, 1 WHERE COALESCE(NEW.original_audio_url, '') != ''
+            ON CONFLICT (blob_name) DO UPDATE SET refcount = refcount + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS qa_results_original_blob_delete AFTER DELETE ON qa_results
+        WHEN COALESCE(OLD.original_audio_url, '') != ''
+        BEGIN
+            UPDATE audio_blobs SET refcount = refcount - 1 WHERE blob_name = OLD.original_audio_url;
+        END
+    """)
+
+
+def _cached_audio_blob(conn):
+    """Stored audio blob per cached analysis, so a cache hit needs no encode or upload"""
+    _add_column_if_missing(conn, "analysis_cache", "audio_blob", "TEXT")
+
+
+# (version, description, apply) in the order they run; never renumber or edit a shipped step
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "qa_results summary and darts_score columns", _listing_columns),
+    (3, "indexes for history, jobs and cache queries", _hot_query_indexes),
+    (4, "full-text search index", _search_index),
+    (5, "DARTS sub-score, objection and meeting columns", _call_metrics),
+    (6, "qa_results keyed by id only (timestamp no longer unique)", _id_keyed_results),
+    (7, "pending_uploads retry queue", _pending_uploads),
+    (8, "audio_blobs reference counts", _audio_blob_refcounts),
+    (9, "re-parse objection counts and meeting outcomes", _reparse_call_metrics),
+    (10, "qa_results original_audio_url column", _original_audio_column),
+    (11, "analysis_cache audio_blob column", _cached_audio_blob),
+]
+
+
+def schema_version(conn) -> int:
+    """Highest migration applied to this database (0 for a fresh one)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at REAL NOT NULL
+        )
+    """)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").fetchone()[0]
+
+
+def apply_migrations(conn, target: int | None = None) -> int:
+    """
+    Bring the schema up to target (default: latest), one committed step at a time.
+    Returns the resulting schema version.
+    """
+    current = schema_version(conn)
+    for version, description, apply in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        start = time.perf_counter()
+        apply(conn)
+        conn.execute(
+            "INSERT OR IGNORE INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)",
+            (version, description, time.time())
+        )
+        conn.commit()
+        current = version
+        print(f"[INFO] Applied migration {version} ({description}) in {time.perf_counter() - start:.2f}s")
+    return current
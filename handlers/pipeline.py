@@ -0,0 +1,334 @@
+import os
+import time
+import uuid
+import shutil
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import pytz
+from .gemini import extract_darts_score, record_darts_score, reanalyze_text, analyze_audio, MAX_AUDIO_BYTES
+from .cache import lookup_audio_analysis, store_audio_analysis, analyze_transcript_cached
+from .database import (
+    save_result, mark_upload_pending, get_pending_uploads, record_upload_failure, set_record_audio
+)
+from .storage import upload_audio, content_blob_name, sha256_file
+from .audio import preprocess_audio, AUDIO_KEEP_ORIGINAL, CHUNKING_AVAILABLE
+
+AUDIO_MIME_TYPES = {'mp3': 'audio/mp3', 'wav': 'audio/wav', 'ogg': 'audio/ogg', 'm4a': 'audio/mp4'}
+
+# Storage uploads run here, alongside the Gemini calls for the same recording
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "4"))
+_upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="upload")
+
+# Tries per upload while the call is processed; after that the record is saved
+# without audio and the upload is retried in the background
+UPLOAD_ATTEMPTS = int(os.environ.get("UPLOAD_ATTEMPTS", "3"))
+UPLOAD_RETRY_INTERVAL = float(os.environ.get("UPLOAD_RETRY_INTERVAL", "300"))
+
+# Local copies of audio waiting for a retried upload (survive restarts)
+PENDING_UPLOAD_DIR = Path(__file__).parent.parent / ".pending_uploads"
+PENDING_UPLOAD_DIR.mkdir(exist_ok=True)
+
+_upload_stats_lock = threading.Lock()
+_upload_stats = {'uploads': 0, 'retries': 0, 'failed': 0, 'upload_seconds': 0.0, 'saved_seconds': 0.0,
+                 'background_retries': 0, 'background_uploaded': 0}
+
+
+def audio_mime_type(filename: str, content_type: str = "") -> str:
+    """Pick the Gemini mime type from the file extension, falling back to the upload's type"""
+    ext = filename.lower().split('.')[-1]
+    return AUDIO_MIME_TYPES.get(ext, content_type or 'audio/mpeg')
+
+
+def extract_zip_audio(zip_file, max_file_bytes: int, dest_dir: Path) -> list:
+    """
+    Stream audio files out of a zip archive (a path or seekable file) into dest_dir.
+    Returns a list of (filename, path, mime_type); other entries are skipped.
+    """
+    files = []
+    try:
+        with zipfile.ZipFile(zip_file) as archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name or info.filename.startswith('__MACOSX/'):
+                    continue
+                if name.lower().split('.')[-1] not in AUDIO_MIME_TYPES:
+                    continue
+                # Check the declared size before inflating anything
+                if info.file_size > max_file_bytes:
+                    raise ValueError(f"{name} is too large (max {max_file_bytes // 1_000_000}MB)")
+                path = dest_dir / uuid.uuid4().hex
+                with archive.open(info) as src, open(path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                files.append((name, path, audio_mime_type(name)))
+    except BaseException:
+        for _, path, _ in files:
+            path.unlink(missing_ok=True)
+        raise
+    return files
+
+
+def build_qualifiers_context(qualifiers: str, skip_qualifiers: bool) -> str:
+    """Build the qualifiers block appended to the QA prompt"""
+    if skip_qualifiers or not qualifiers.strip():
+        return ""
+    return f"""
+
+## QUALIFIERS TO CHECK AGAINST:
+{qualifiers.strip()}
+
+IMPORTANT: Use these qualifiers to verify appointment qualification in Section 7. Check if the prospect matches the qualifiers (KDMs, timeline, size thresholds) and note any disqualifiers mentioned.
+"""
+
+
+def _upload_with_retries(path: Path, filename: str, digest: str | None = None) -> dict:
+    """Upload with UPLOAD_ATTEMPTS tries and backoff. Never raises: {'blob', 'seconds', 'attempts'}"""
+    start = time.perf_counter()
+    blob_name = None
+    attempt = 0
+    while blob_name is None and attempt < UPLOAD_ATTEMPTS:
+        if attempt:
+            time.sleep(2 ** (attempt - 1))
+        attempt += 1
+        blob_name = upload_audio(path, filename, digest)
+    return {'blob': blob_name, 'seconds': time.perf_counter() - start, 'attempts': attempt}
+
+
+def _keep_for_retry(path: Path) -> Path:
+    """Copy audio whose upload failed somewhere it outlives the job"""
+    pending_path = PENDING_UPLOAD_DIR / uuid.uuid4().hex
+    shutil.copyfile(path, pending_path)
+    return pending_path
+
+
+def retry_pending_uploads():
+    """Upload audio for records saved while storage was failing, backing off per record"""
+    for pending in get_pending_uploads():
+        record_id, path = pending['record_id'], Path(pending['path'])
+        try:
+            if not path.exists():
+                # Nothing left to upload; stop retrying and leave the record without audio
+                set_record_audio(record_id, "")
+                print(f"[WARN] Pending audio for record {record_id} is gone, giving up")
+                continue
+            with _upload_stats_lock:
+                _upload_stats['background_retries'] += 1
+            blob_name = upload_audio(path, pending['filename'])
+            if blob_name is None:
+                record_upload_failure(record_id, "upload failed",
+                                      min(UPLOAD_RETRY_INTERVAL * 2 ** pending['attempts'], 86400))
+                continue
+            set_record_audio(record_id, blob_name)
+            path.unlink(missing_ok=True)
+            with _upload_stats_lock:
+                _upload_stats['background_uploaded'] += 1
+            print(f"[INFO] Uploaded pending audio for record {record_id}")
+        except Exception as e:
+            print(f"[ERROR] retry_pending_uploads record {record_id}: {e}")
+
+
+def start_upload_retries():
+    """Retry pending uploads now and every UPLOAD_RETRY_INTERVAL seconds after"""
+    def loop():
+        while True:
+            try:
+                retry_pending_uploads()
+            except Exception as e:
+                print(f"[ERROR] retry_pending_uploads: {e}")
+            time.sleep(UPLOAD_RETRY_INTERVAL)
+
+    threading.Thread(target=loop, name="upload-retry", daemon=True).start()
+
+
+def get_upload_stats() -> dict:
+    """Upload/analysis overlap counters for /api/stats"""
+    with _upload_stats_lock:
+        stats = dict(_upload_stats)
+    stats['upload_seconds'] = round(stats['upload_seconds'], 2)
+    stats['saved_seconds'] = round(stats['saved_seconds'], 2)
+    return stats
+
+
+def pht_timestamp() -> str:
+    """Current time formatted as a PHT record timestamp"""
+    manila = pytz.timezone('Asia/Manila')
+    return datetime.now(manila).strftime("%Y-%m-%d %I:%M:%S %p PHT")
+
+
+def run_pipeline(filename: str, qualifiers_context: str = "", audio_path: Path | None = None,
+                 mime_type: str = "", transcript: str = "", on_stage=None, on_chunk=None) -> dict:
+    """
+    Run one call through upload, Gemini analysis and save.
+    Pass audio_path (a spooled upload) for audio calls, or transcript for pasted transcripts.
+    on_stage(str) is called as the pipeline moves between steps;
+    on_chunk(str) receives the analysis text as it streams in.
+    """
+    stage = on_stage or (lambda _: None)
+
+    timestamp = pht_timestamp()
+    transcript_text = ""
+    audio_blob_name = ""
+    structured = None
+    preprocess_stats = None
+    upload_stats = None
+    retry_path = None
+    original_blob_name = ""
+
+    cache_key, hit = None, None
+    if audio_path is not None:
+        # Hashed once: keys the cache (so a repeat is found before any encoding or upload)
+        # and names the stored blob
+        digest = sha256_file(audio_path)
+        cache_key, hit = lookup_audio_analysis(digest, qualifiers_context)
+
+    if audio_path is None:
+        stage("Analyzing transcript with Gemini")
+        result = analyze_transcript_cached(transcript, qualifiers_context, on_chunk)
+    elif hit and hit['audio_blob']:
+        # Seen before and its compressed audio is already stored: nothing to encode, upload or analyze
+        if on_chunk:
+            on_chunk(hit['analysis'])
+        result = {**hit, 'cached': True}
+        transcript_text = result['transcript']
+        structured = result.get('structured')
+        audio_blob_name = hit['audio_blob']
+        # As on a miss, the original is only kept when the stored audio is a compressed copy.
+        # Content-addressed, so an upload stored as is has the same name as the stored audio
+        if AUDIO_KEEP_ORIGINAL and content_blob_name(digest, filename) != audio_blob_name:
+            original_blob_name = upload_audio(audio_path, "original_" + filename, digest) or ""
+    else:
+        stage("Compressing audio")
+        prepared = preprocess_audio(audio_path, filename, mime_type)
+        preprocess_stats = {k: prepared[k] for k in ('original_size', 'size', 'seconds', 'converted')}
+        try:
+            # Long calls over the limit can still be transcribed segment by segment
+            if prepared['size'] > MAX_AUDIO_BYTES and not CHUNKING_AVAILABLE:
+                raise ValueError(f"Audio file too large (max {MAX_AUDIO_BYTES // 1_000_000}MB)")
+
+            # The storage upload runs while Gemini analyzes; they only meet again at save time
+            stage("Analyzing audio with Gemini")
+            start = time.perf_counter()
+            prepared_digest = sha256_file(prepared['path']) if prepared['converted'] else digest
+            upload = _upload_executor.submit(_upload_with_retries, prepared['path'], prepared['filename'],
+                                             prepared_digest)
+            original_upload = None
+            if prepared['converted'] and AUDIO_KEEP_ORIGINAL:
+                original_upload = _upload_executor.submit(_upload_with_retries, audio_path, "original_" + filename,
+                                                          digest)
+            try:
+                if hit:
+                    # Cached before its audio was stored (or the upload failed): only the analysis is reused
+                    if on_chunk:
+                        on_chunk(hit['analysis'])
+                    result = {**hit, 'cached': True}
+                else:
+                    # Gemini gets the file itself: Files API uploads and ffprobe/ffmpeg read it from disk
+                    result = {**analyze_audio(prepared['path'], prepared['mime_type'], qualifiers_context, on_chunk,
+                                              prepared_digest),
+                              'cached': False}
+                transcript_text = result['transcript']
+                structured = result.get('structured')
+                analysis_seconds = time.perf_counter() - start
+            finally:
+                # The files are deleted below, so the uploads must be finished with them first
+                if not upload.done():
+                    stage("Finishing audio upload")
+                uploaded = upload.result()
+                if original_upload is not None:
+                    original_blob_name = original_upload.result()['blob'] or ""
+                    if not original_blob_name:
+                        print(f"[WARN] Original audio for {filename} was not kept (upload failed)")
+            elapsed = time.perf_counter() - start
+
+            audio_blob_name = uploaded['blob'] or ""
+            if not audio_blob_name:
+                retry_path = _keep_for_retry(prepared['path'])
+            store_audio_analysis(cache_key, result, audio_blob_name or None)
+
+            # Run back to back these would have taken upload + analysis
+            saved_seconds = max(0.0, uploaded['seconds'] + analysis_seconds - elapsed)
+            upload_stats = {
+                'upload_seconds': round(uploaded['seconds'], 2),
+                'analysis_seconds': round(analysis_seconds, 2),
+                'saved_seconds': round(saved_seconds, 2),
+                'attempts': uploaded['attempts'],
+                'pending': retry_path is not None
+            }
+            with _upload_stats_lock:
+                _upload_stats['uploads'] += 1
+                _upload_stats['retries'] += uploaded['attempts'] - 1
+                _upload_stats['failed'] += retry_path is not None
+                _upload_stats['upload_seconds'] += uploaded['seconds']
+                _upload_stats['saved_seconds'] += saved_seconds
+            print(f"[TIMING] {filename}: upload {uploaded['seconds']:.2f}s overlapped with analysis "
+                  f"{analysis_seconds:.2f}s, saved {saved_seconds:.2f}s")
+        finally:
+            if prepared['converted']:
+                prepared['path'].unlink(missing_ok=True)
+
+    result_text = result['analysis']
+    darts_score = record_darts_score(result_text, structured)
+
+    stage("Saving to history")
+    record_id = save_result(timestamp, filename, result_text, transcript_text, audio_blob_name, structured,
+                            original_blob_name)
+    if record_id is None:
+        result_text += "\n\n⚠️ Failed to save to history"
+
+    if retry_path is not None:
+        try:
+            if record_id is None:
+                raise RuntimeError("record was not saved")
+            mark_upload_pending(record_id, str(retry_path), prepared['filename'])
+            print(f"[WARN] Audio upload for record {record_id} failed, queued for retry")
+        except Exception as e:
+            print(f"[ERROR] Could not queue audio upload for {filename}: {e}")
+            retry_path.unlink(missing_ok=True)
+
+    return {
+        'timestamp': timestamp,
+        'filename': filename,
+        'result_text': result_text,
+        'transcript': transcript_text,
+        'audio_blob': audio_blob_name,
+        'original_audio_blob': original_blob_name,
+        'structured': structured,
+        'darts_score': darts_score,
+        'cached': result['cached'],
+        'preprocess': preprocess_stats,
+        'upload': upload_stats,
+        'record_id': record_id,
+        'saved': record_id is not None
+    }
+
+
+def run_reanalysis(edited_text: str, on_stage=None, on_chunk=None) -> dict:
+    """Re-analyze an edited result and save it as a new record"""
+    stage = on_stage or (lambda _: None)
+
+    stage("Re-analyzing with Gemini")
+    result_text = reanalyze_text(edited_text, on_chunk)
+
+    timestamp = pht_timestamp()
+    filename = "Re-analyzed"
+    darts_score = extract_darts_score(result_text)
+
+    stage("Saving to history")
+    record_id = save_result(timestamp, filename, result_text)
+    if record_id is None:
+        result_text += "\n\n⚠️ Failed to save to history"
+
+    return {
+        'timestamp': timestamp,
+        'filename': filename,
+        'result_text': result_text,
+        'transcript': "",
+        'audio_blob': "",
+        'structured': None,
+        'darts_score': darts_score,
+        'cached': False,
+        'record_id': record_id,
+        'saved': record_id is not None
+    }
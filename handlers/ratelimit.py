@@ -0,0 +1,162 @@
+import os
+import time
+import random
+import threading
+from config import GEMINI_MAX_WORKERS
+
+# Quota to stay just under, e.g. 15 / 1000000 on the Gemini 2.0 Flash free tier.
+# Unset (or 0) means no client-side cap; 429s are still retried with backoff.
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM") or 0)
+GEMINI_TPM = int(os.environ.get("GEMINI_TPM") or 0)
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "5"))
+
+# Retry delays: base * 2^attempt with jitter, capped
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 60.0
+
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `per_minute` tokens per minute"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float) -> float:
+        """Block until `amount` tokens are available. Returns seconds waited."""
+        # A single request larger than the bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def credit(self, amount: float):
+        """Return (or, if negative, take) tokens once real usage is known"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on in-flight requests: halve on throttling,
+    grow by roughly one slot per window of successful requests.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= max(1, int(self.limit)):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def on_throttle(self):
+        with self.cond:
+            self.limit = max(1.0, self.limit / 2)
+
+    def on_success(self):
+        with self.cond:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self.cond.notify_all()
+
+
+_requests = TokenBucket(GEMINI_RPM) if GEMINI_RPM > 0 else None
+_tokens = TokenBucket(GEMINI_TPM) if GEMINI_TPM > 0 else None
+_concurrency = AdaptiveConcurrency(GEMINI_MAX_WORKERS)
+
+_stats = {'calls': 0, 'throttles': 0, 'retries': 0, 'errors': 0, 'wait_seconds': 0.0}
+_stats_lock = threading.Lock()
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for name, delta in deltas.items():
+            _stats[name] += delta
+
+
+def _is_throttle(error: Exception) -> bool:
+    return getattr(error, 'code', None) == 429
+
+
+def _is_retryable(error: Exception) -> bool:
+    return getattr(error, 'code', None) in RETRYABLE_CODES
+
+
+def call_with_limits(fn, estimated_tokens: int = 0, rate_limited: bool = True):
+    """
+    Run fn() under the shared RPM/TPM buckets (when configured) and adaptive concurrency limit,
+    retrying 429/5xx errors with jittered exponential backoff.
+    If the result has usage_metadata, the token bucket is corrected to actual usage.
+    """
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        if rate_limited:
+            waited = (_requests.acquire(1) if _requests else 0.0) + \
+                     (_tokens.acquire(estimated_tokens) if _tokens else 0.0)
+            _count(wait_seconds=waited)
+
+        _concurrency.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            if _is_throttle(e):
+                _concurrency.on_throttle()
+                _count(throttles=1)
+            if not _is_retryable(e) or attempt == GEMINI_MAX_RETRIES:
+                _count(errors=1)
+                if _is_throttle(e):
+                    raise RuntimeError("Gemini quota exceeded, please try again in a minute") from e
+                raise
+            delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.5)
+            _count(retries=1, wait_seconds=delay)
+            print(f"[WARN] Gemini error {getattr(e, 'code', '?')}, retry {attempt + 1} in {delay:.1f}s")
+        else:
+            _concurrency.on_success()
+            _count(calls=1)
+            usage = getattr(result, 'usage_metadata', None)
+            actual = getattr(usage, 'total_token_count', None) if usage else None
+            if rate_limited and _tokens and actual:
+                _tokens.credit(estimated_tokens - actual)
+            return result
+        finally:
+            _concurrency.release()
+
+        time.sleep(delay)
+
+
+def get_rate_limit_stats() -> dict:
+    """Counters for throttles, retries and time spent waiting on the limiter"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['wait_seconds'] = round(stats['wait_seconds'], 2)
+    stats['concurrency_limit'] = round(_concurrency.limit, 2)
+    stats['in_flight'] = _concurrency.in_flight
+    stats['rpm_limit'] = GEMINI_RPM or None
+    stats['tpm_limit'] = GEMINI_TPM or None
+    return stats
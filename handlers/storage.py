@@ -1,6 +1,12 @@
 import os
 import re
 import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
 from datetime import timedelta
 from pathlib import Path
 
@@ -23,58 +29,162 @@ def sanitize_filename(filename: str) -> str:
     return re.sub(r'[^a-zA-Z0-9._-]', '_', filename)
 
 
+# Resumable upload chunk size (GCS requires a multiple of 256KB)
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Signed URLs are valid for SIGNED_URL_HOURS and reused until shortly before they expire
+SIGNED_URL_HOURS = 1
+SIGNED_URL_CACHE_SECONDS = SIGNED_URL_HOURS * 3600 - 600
+SIGNED_URL_CACHE_SIZE = 1024
+
+_client = None
+_client_ready = False
+_client_lock = threading.Lock()
+
+_signed_urls = OrderedDict()  # blob name -> (url, cached_until)
+_signed_urls_lock = threading.Lock()
+_url_stats = {'hits': 0, 'misses': 0}
+
+_upload_stats_lock = threading.Lock()
+_upload_stats = {'uploads': 0, 'deduplicated': 0, 'bytes_uploaded': 0, 'bytes_skipped': 0,
+                 'upload_seconds': 0.0, 'dedup_seconds': 0.0}
+
+
 def get_storage_client():
-    """Get Google Cloud Storage client, or None for mock mode"""
-    if not _has_credentials:
-        return None
-    try:
-        from google.cloud import storage
-        creds_dict = json.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"])
-        from google.oauth2 import service_account
-        credentials = service_account.Credentials.from_service_account_info(creds_dict)
-        client = storage.Client(credentials=credentials, project=creds_dict.get('project_id'))
-        return client
-    except (json.JSONDecodeError, ImportError, KeyError) as e:
-        print(f"Storage client error: {e}")
+    """Process-wide Google Cloud Storage client (built once), or None for mock mode"""
+    global _client, _client_ready
+    if _client_ready:
+        return _client
+    with _client_lock:
+        if _client_ready:
+            return _client
+        if not _has_credentials:
+            _client_ready = True
+            return None
+        try:
+            from google.cloud import storage
+            creds_dict = json.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"])
+            from google.oauth2 import service_account
+            credentials = service_account.Credentials.from_service_account_info(creds_dict)
+            _client = storage.Client(credentials=credentials, project=creds_dict.get('project_id'))
+            _client_ready = True
+            return _client
+        except (json.JSONDecodeError, ImportError, KeyError) as e:
+            # Bad credentials won't fix themselves; don't retry on every request
+            print(f"Storage client error: {e}")
+            _client_ready = True
+            return None
+
+
+def _cached_signed_url(blob_name: str) -> str | None:
+    with _signed_urls_lock:
+        entry = _signed_urls.get(blob_name)
+        if entry and time.monotonic() < entry[1]:
+            _signed_urls.move_to_end(blob_name)
+            _url_stats['hits'] += 1
+            return entry[0]
+        _signed_urls.pop(blob_name, None)
+        _url_stats['misses'] += 1
         return None
 
 
-def upload_audio(audio_bytes: bytes, filename: str, timestamp: str) -> str | None:
+def _cache_signed_url(blob_name: str, url: str):
+    with _signed_urls_lock:
+        _signed_urls[blob_name] = (url, time.monotonic() + SIGNED_URL_CACHE_SECONDS)
+        _signed_urls.move_to_end(blob_name)
+        while len(_signed_urls) > SIGNED_URL_CACHE_SIZE:
+            _signed_urls.popitem(last=False)
+
+
+def get_storage_stats() -> dict:
+    """Signed URL cache and upload dedup counters for /api/stats"""
+    with _signed_urls_lock:
+        stats = {**_url_stats, 'cached_urls': len(_signed_urls), 'mock': not _has_credentials}
+    with _upload_stats_lock:
+        stats.update(_upload_stats)
+    stats['upload_seconds'] = round(stats['upload_seconds'], 2)
+    stats['dedup_seconds'] = round(stats['dedup_seconds'], 2)
+    return stats
+
+
+def sha256_file(path: Path) -> str:
+    """sha256 hex digest of a file, read UPLOAD_CHUNK_BYTES at a time rather than whole"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(UPLOAD_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_blob_name(digest: str, filename: str) -> str:
     """
-    Upload audio file to GCS or mock storage.
-    Returns the blob name on success, None on failure.
+    Content-addressed blob name: the file's sha256_file digest plus the filename's
+    extension (kept so content type and playback still work from the name alone).
     """
-    global mock_audio_storage
+    ext = os.path.splitext(sanitize_filename(filename))[1].lower()
+    return digest + ext
+
+
+def audio_content_type(filename: str) -> str:
+    """Content type for storing and serving audio, from the file extension"""
+    if filename.lower().endswith(".wav"):
+        return "audio/wav"
+    elif filename.lower().endswith(".m4a"):
+        return "audio/mp4"
+    elif filename.lower().endswith(".ogg"):
+        return "audio/ogg"
+    return "audio/mpeg"
 
-    # Sanitize filename and create unique blob name
-    safe_filename = sanitize_filename(filename)
-    blob_name = f"{timestamp.replace(' ', '_').replace(':', '-')}_{safe_filename}"
 
+def upload_audio(audio_path: Path, filename: str, digest: str | None = None) -> str | None:
+    """
+    Upload an audio file from disk to GCS or mock storage, named by its content
+    (see content_blob_name). Nothing is transferred when that blob already exists,
+    so a recording uploaded again shares the stored copy.
+    Pass digest when the caller has already hashed the file.
+    GCS uploads are resumable and sent in UPLOAD_CHUNK_BYTES pieces, never read whole.
+    Returns the blob name on success, None on failure.
+    """
+    start = time.perf_counter()
     try:
+        blob_name = content_blob_name(digest or sha256_file(audio_path), filename)
+        size = audio_path.stat().st_size
+
         client = get_storage_client()
         if client is not None:
             bucket = client.bucket(GCS_BUCKET_NAME)
-            blob = bucket.blob(blob_name)
-
-            # Determine content type from filename
-            content_type = "audio/mpeg"
-            if filename.lower().endswith(".wav"):
-                content_type = "audio/wav"
-            elif filename.lower().endswith(".m4a"):
-                content_type = "audio/mp4"
-            elif filename.lower().endswith(".ogg"):
-                content_type = "audio/ogg"
-
-            blob.upload_from_string(audio_bytes, content_type=content_type)
-            return blob_name
+            blob = bucket.blob(blob_name, chunk_size=UPLOAD_CHUNK_BYTES)
+            exists = blob.exists()
+            if not exists:
+                blob.upload_from_filename(str(audio_path), content_type=audio_content_type(filename))
         else:
             # Mock mode: store to disk (persists across restarts)
             mock_path = MOCK_AUDIO_DIR / blob_name
-            mock_path.write_bytes(audio_bytes)
-            return blob_name
-    except Exception:
+            exists = mock_path.exists()
+            if not exists:
+                # Copy then rename, so a half-written file is never served under the final name
+                partial_path = MOCK_AUDIO_DIR / f".{uuid.uuid4().hex}.partial"
+                try:
+                    shutil.copyfile(audio_path, partial_path)
+                    os.replace(partial_path, mock_path)
+                finally:
+                    partial_path.unlink(missing_ok=True)
+    except Exception as e:
+        print(f"[ERROR] upload_audio {filename}: {e}")
         return None
 
+    seconds = time.perf_counter() - start
+    with _upload_stats_lock:
+        if exists:
+            _upload_stats['deduplicated'] += 1
+            _upload_stats['bytes_skipped'] += size
+            _upload_stats['dedup_seconds'] += seconds
+        else:
+            _upload_stats['uploads'] += 1
+            _upload_stats['bytes_uploaded'] += size
+            _upload_stats['upload_seconds'] += seconds
+    return blob_name
+
 
 def get_audio_url(blob_name: str) -> str | None:
     """
@@ -87,20 +197,23 @@ def get_audio_url(blob_name: str) -> str | None:
     try:
         client = get_storage_client()
         if client is not None:
+            url = _cached_signed_url(blob_name)
+            if url:
+                return url
+
             bucket = client.bucket(GCS_BUCKET_NAME)
             blob = bucket.blob(blob_name)
 
-            # Generate signed URL valid for 1 hour
             url = blob.generate_signed_url(
                 version="v4",
-                expiration=timedelta(hours=1),
+                expiration=timedelta(hours=SIGNED_URL_HOURS),
                 method="GET"
             )
+            _cache_signed_url(blob_name, url)
             return url
         else:
             # Mock mode: check if file exists on disk
-            mock_path = MOCK_AUDIO_DIR / blob_name
-            if mock_path.exists():
+            if get_mock_audio_path(blob_name):
                 from urllib.parse import quote
                 return f"/api/audio?file={quote(blob_name)}"
             return None
@@ -109,9 +222,12 @@ def get_audio_url(blob_name: str) -> str | None:
         return None
 
 
-def get_mock_audio(blob_name: str) -> bytes | None:
-    """Get audio bytes from mock storage (for local testing)"""
-    mock_path = MOCK_AUDIO_DIR / blob_name
-    if mock_path.exists():
-        return mock_path.read_bytes()
-    return None
+def get_mock_audio_path(blob_name: str) -> Path | None:
+    """
+    Path of a blob in mock storage (for local testing), or None if it doesn't exist.
+    Names that would resolve outside MOCK_AUDIO_DIR are rejected.
+    """
+    mock_path = (MOCK_AUDIO_DIR / blob_name).resolve()
+    if mock_path.parent != MOCK_AUDIO_DIR.resolve() or not mock_path.is_file():
+        return None
+    return mock_path
@@ -1,26 +1,36 @@
 from fasthtml.common import *
 from datetime import datetime
-import pytz
+from email.utils import parsedate_to_datetime
+import asyncio
 import os
 
 from config import SESSION_SECRET, CSS
 from handlers import (
-    analyze_audio, analyze_transcript, reanalyze_text, extract_darts_score,
-    save_result, get_history, find_record_by_timestamp,
-    upload_audio, get_audio_url, get_mock_audio
+    list_history, find_record, find_record_by_timestamp, search_results,
+    get_audio_url, get_mock_audio_path, audio_content_type, MAX_UPLOAD_BYTES, get_rate_limit_stats,
+    flush_writes, get_write_stats, get_replica_stats, get_compression_stats, get_analytics,
+    get_record_cache_stats, get_storage_stats,
+    build_qualifiers_context, audio_mime_type, spool_upload, spool_zip_upload,
+    submit_job, submit_batch, get_job, get_job_partial, get_batch_jobs, resume_pending_jobs,
+    get_memory_stats, start_upload_retries, get_upload_stats
 )
 from components import (
     render_process_tab, render_results_card, render_history_card,
     render_edit_form, render_result_detail, render_analysis_content,
-    render_transcript_content
+    render_transcript_content, render_job_status, render_batch_status,
+    render_job_stage, render_stream_partial, render_job_done, render_history_sentinel,
+    render_history_search, render_search_results
 )
 
 app, rt = fast_app(
     secret_key=SESSION_SECRET,
     hdrs=(
         Script(src="https://unpkg.com/htmx.org@1.9.10"),
+        Script(src="https://unpkg.com/htmx.org@1.9.10/dist/ext/sse.js"),
         Style(CSS),
-    )
+    ),
+    on_startup=[resume_pending_jobs, start_upload_retries],
+    on_shutdown=[flush_writes]
 )
 
 
@@ -29,6 +39,25 @@ app, rt = fast_app(
 def health():
     return {"status": "ok", "timestamp": datetime.now().isoformat()}
 
+
+@rt("/api/stats")
+def stats():
+    """Runtime counters for monitoring"""
+    return {"gemini": get_rate_limit_stats(), "saves": get_write_stats(),
+            "replica": get_replica_stats(), "compression": get_compression_stats(),
+            "records": get_record_cache_stats(), "storage": get_storage_stats(),
+            "uploads": get_upload_stats(), "memory": get_memory_stats()}
+
+
+@rt("/api/analytics")
+def analytics(days: int = 30):
+    """DARTS score distributions and daily trends over the last `days` days"""
+    try:
+        return get_analytics(max(1, min(days, 3650)))
+    except Exception as e:
+        print(f"[ERROR] analytics: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
 # ============ MAIN ROUTES ============
 @rt("/")
 def home():
@@ -68,9 +97,16 @@ def tab_process():
 
 
 @rt("/tab/history")
-def tab_history():
+def tab_history(before: str = None, before_id: int = None):
+    """History grid; later pages are appended as the sentinel scrolls into view"""
     try:
-        records = get_history()
+        records, next_cursor = list_history(before=before, before_id=before_id)
+        cards = [render_history_card(record, idx) for idx, record in enumerate(records)]
+        sentinel = render_history_sentinel(next_cursor) if next_cursor else None
+
+        # Next page: just the cards plus a new sentinel, swapped in place of the old one
+        if before is not None:
+            return (*cards, sentinel)
 
         if not records:
             return Div(cls="empty-state")(
@@ -78,11 +114,11 @@ def tab_history():
                 P("Upload a call recording to get started!")
             )
 
-        # Limit to 50 (already sorted newest first from DB)
-        records_copy = list(records)[:50]
-
-        return Div(cls="history-grid")(
-            *[render_history_card(record, idx) for idx, record in enumerate(records_copy)]
+        return Div(
+            render_history_search(),
+            Div(id="history-results")(
+                Div(cls="history-grid")(*cards, sentinel)
+            )
         )
 
     except Exception as e:
@@ -93,11 +129,28 @@ def tab_history():
         )
 
 
-@rt("/result/{timestamp}")
-def view_result(timestamp: str):
+@rt("/search")
+def search(q: str = ""):
+    """Full-text search results for the history search box (empty query shows the grid again)"""
+    if not q.strip():
+        records, next_cursor = list_history()
+        cards = [render_history_card(record, idx) for idx, record in enumerate(records)]
+        return Div(cls="history-grid")(*cards, render_history_sentinel(next_cursor) if next_cursor else None)
+
+    return render_search_results(q, search_results(q))
+
+
+def lookup_record(record_key: str) -> dict | None:
+    """Record by id, or by its encoded timestamp for links made before record ids"""
+    if record_key.isdigit():
+        return find_record(int(record_key))
+    return find_record_by_timestamp(record_key.replace('_', ' ').replace('~', ':'))
+
+
+@rt("/result/{record_key}")
+def view_result(record_key: str):
     try:
-        timestamp_clean = timestamp.replace('_', ' ').replace('~', ':')
-        record = find_record_by_timestamp(timestamp_clean)
+        record = lookup_record(record_key)
 
         if not record:
             return Div(cls="card")(
@@ -115,8 +168,11 @@ def view_result(timestamp: str):
         audio_blob = record.get('Audio_URL', '')
         if audio_blob:
             record['Audio_URL'] = get_audio_url(audio_blob) or ''
+        original_blob = record.get('Original_Audio_URL', '')
+        if original_blob:
+            record['Original_Audio_URL'] = get_audio_url(original_blob) or ''
 
-        return render_result_detail(record, timestamp_clean, timestamp)
+        return render_result_detail(record)
 
     except Exception as e:
         return Div(cls="card")(
@@ -126,12 +182,11 @@ def view_result(timestamp: str):
         )
 
 
-@rt("/result/{timestamp}/analysis")
-def view_result_analysis(timestamp: str):
+@rt("/result/{record_key}/analysis")
+def view_result_analysis(record_key: str):
     """Return just the analysis content for HTMX swap"""
     try:
-        timestamp_clean = timestamp.replace('_', ' ').replace('~', ':')
-        record = find_record_by_timestamp(timestamp_clean)
+        record = lookup_record(record_key)
 
         if not record:
             return P("Result not found", cls="error-text")
@@ -139,18 +194,17 @@ def view_result_analysis(timestamp: str):
         filename = record.get('Filename', 'Unknown')
         result_text = record.get('Full Result', '')
 
-        return render_analysis_content(result_text, filename, timestamp_clean)
+        return render_analysis_content(result_text, filename, record['Timestamp'])
 
     except Exception as e:
         return P(f"Error: {str(e)}", cls="error-text")
 
 
-@rt("/result/{timestamp}/transcript")
-def view_result_transcript(timestamp: str):
+@rt("/result/{record_key}/transcript")
+def view_result_transcript(record_key: str):
     """Return just the transcript content for HTMX swap"""
     try:
-        timestamp_clean = timestamp.replace('_', ' ').replace('~', ':')
-        record = find_record_by_timestamp(timestamp_clean)
+        record = lookup_record(record_key)
 
         if not record:
             return P("Result not found", cls="error-text")
@@ -170,68 +224,56 @@ def view_result_transcript(timestamp: str):
                 P("Transcripts are only available for new audio uploads.", cls="info-text")
             )
 
-        return render_transcript_content(transcript, audio_url, filename, timestamp_clean)
+        return render_transcript_content(transcript, audio_url, filename, record['Timestamp'],
+                                         record.get('Structured'))
 
     except Exception as e:
         return P(f"Error: {str(e)}", cls="error-text")
 
 
+# Local blobs never change once written (names are content hashes)
+AUDIO_CACHE_CONTROL = "private, max-age=86400"
+
+
+def audio_not_modified(request, etag: str, last_modified: str) -> bool:
+    """Whether the browser's cached copy is current (If-None-Match, else If-Modified-Since)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
 @rt("/api/audio")
 def serve_audio(request, file: str = ""):
-    """Serve audio file (for mock mode) or redirect to signed URL with range request support"""
+    """Serve audio file (for mock mode) or redirect to signed URL"""
     blob_name = file
     if not blob_name:
         return Response(content="No file specified", status_code=400)
 
-    # Check if this is mock audio
-    mock_bytes = get_mock_audio(blob_name)
-    if mock_bytes:
-        # Determine content type
-        content_type = "audio/mpeg"
-        if blob_name.lower().endswith(".wav"):
-            content_type = "audio/wav"
-        elif blob_name.lower().endswith(".m4a"):
-            content_type = "audio/mp4"
-        elif blob_name.lower().endswith(".ogg"):
-            content_type = "audio/ogg"
-
-        file_size = len(mock_bytes)
-        range_header = request.headers.get("range")
-
-        if range_header:
-            # Parse range header (e.g., "bytes=0-1000")
-            try:
-                range_spec = range_header.replace("bytes=", "")
-                start_str, end_str = range_spec.split("-")
-                start = int(start_str) if start_str else 0
-                end = int(end_str) if end_str else file_size - 1
-                end = min(end, file_size - 1)
-
-                content_length = end - start + 1
-                return Response(
-                    content=mock_bytes[start:end + 1],
-                    status_code=206,
-                    media_type=content_type,
-                    headers={
-                        "Content-Range": f"bytes {start}-{end}/{file_size}",
-                        "Accept-Ranges": "bytes",
-                        "Content-Length": str(content_length),
-                        "Content-Disposition": f"inline; filename={blob_name}"
-                    }
-                )
-            except (ValueError, IndexError):
-                pass  # Fall through to return full file
-
-        # No range request - return full file
-        return Response(
-            content=mock_bytes,
-            media_type=content_type,
-            headers={
-                "Accept-Ranges": "bytes",
-                "Content-Length": str(file_size),
-                "Content-Disposition": f"inline; filename={blob_name}"
-            }
+    mock_path = get_mock_audio_path(blob_name)
+    if mock_path:
+        # FileResponse seeks to the requested ranges and streams only those bytes
+        # (zero-copy where the server supports it): single, suffix and multi-range
+        # requests get a 206, unsatisfiable ones a 416, and If-Range is honoured
+        response = FileResponse(
+            mock_path, media_type=audio_content_type(blob_name), stat_result=mock_path.stat(),
+            filename=blob_name, content_disposition_type="inline",
+            headers={"Cache-Control": AUDIO_CACHE_CONTROL}
         )
+        etag, last_modified = response.headers["etag"], response.headers["last-modified"]
+        if audio_not_modified(request, etag, last_modified):
+            return Response(status_code=304, headers={
+                "ETag": etag, "Last-Modified": last_modified, "Cache-Control": AUDIO_CACHE_CONTROL
+            })
+        return response
 
     # For real mode, redirect to signed URL
     signed_url = get_audio_url(blob_name)
@@ -243,34 +285,19 @@ def serve_audio(request, file: str = ""):
 
 # ============ PROCESSING ROUTES ============
 @rt("/process_call", methods=["POST"])
-async def process_call(sess, input_mode: str = "audio", audio: UploadFile = None, transcript: str = "", qualifiers: str = "", skip_qualifiers: str = None):
+async def process_call(input_mode: str = "audio", audio: UploadFile = None, transcript: str = "", qualifiers: str = "", skip_qualifiers: str = None):
+    """Validate the upload and queue it for background analysis"""
     try:
         is_transcript_mode = input_mode == "transcript"
         source_name = "Transcript" if is_transcript_mode else (audio.filename if audio else "Unknown")
 
-        # Build qualifiers context
-        qualifiers_context = ""
-        if skip_qualifiers != "on" and qualifiers.strip():
-            qualifiers_context = f"""
-
-## QUALIFIERS TO CHECK AGAINST:
-{qualifiers.strip()}
-
-IMPORTANT: Use these qualifiers to verify appointment qualification in Section 7. Check if the prospect matches the qualifiers (KDMs, timeline, size thresholds) and note any disqualifiers mentioned.
-"""
+        qualifiers_context = build_qualifiers_context(qualifiers, skip_qualifiers == "on")
 
-        # Generate timestamp early (needed for audio upload)
-        manila = pytz.timezone('Asia/Manila')
-        timestamp = datetime.now(manila).strftime("%Y-%m-%d %I:%M:%S %p PHT")
-
-        # Initialize transcript and audio URL
-        transcript_text = ""
-        audio_blob_name = ""
-
-        # Analyze with Gemini
         if is_transcript_mode:
-            result_text = analyze_transcript(transcript, qualifiers_context)
-            # No transcript extraction for pasted transcripts (already have it)
+            if not transcript.strip():
+                raise ValueError("No transcript provided")
+            job_id = await asyncio.to_thread(submit_job, source_name, qualifiers_context,
+                                             transcript=transcript)
         else:
             # Validate audio file
             if not audio or not audio.filename:
@@ -281,45 +308,138 @@ IMPORTANT: Use these qualifiers to verify appointment qualification in Section 7
             if not content_type.startswith('audio/'):
                 raise ValueError("Only audio files are allowed")
 
-            audio_bytes = await audio.read()
+            # Spooled to disk in chunks; the raw size limit is checked once the request is
+            # received (before copying) and the compressed size against the Gemini limit later
+            audio_path = await spool_upload(audio, MAX_UPLOAD_BYTES)
+            mime_type = audio_mime_type(audio.filename, content_type)
+
+            try:
+                job_id = await asyncio.to_thread(submit_job, source_name, qualifiers_context,
+                                                 audio_path=audio_path, mime_type=mime_type)
+            except Exception:
+                audio_path.unlink(missing_ok=True)
+                raise
+
+        return render_job_status(job_id, "Queued", source_name)
+
+    except Exception as e:
+        return Div(cls="card")(
+            Div(cls="card-body")(
+                P(f"Error: {str(e)}", cls="error-text"),
+                Button("Try Again",
+                       hx_get="/tab/process",
+                       hx_target="#tab-content",
+                       hx_swap="innerHTML")
+            )
+        )
+
 
-            # Validate file size (max 25MB for Gemini)
-            if len(audio_bytes) > 25_000_000:
-                raise ValueError("Audio file too large (max 25MB)")
+@rt("/process_batch", methods=["POST"])
+async def process_batch(request):
+    """Queue many audio files (or zips of them) sharing one qualifiers block"""
+    try:
+        form = await request.form()
+        qualifiers_context = build_qualifiers_context(form.get("qualifiers", ""),
+                                                      form.get("skip_qualifiers") == "on")
+
+        files = []
+        try:
+            for upload in form.getlist("audio"):
+                if not getattr(upload, 'filename', None):
+                    continue
+                if upload.filename.lower().endswith('.zip'):
+                    files.extend(await spool_zip_upload(upload, MAX_UPLOAD_BYTES))
+                    continue
+
+                content_type = getattr(upload, 'content_type', '') or ''
+                if not content_type.startswith('audio/'):
+                    raise ValueError(f"{upload.filename} is not an audio file")
+                audio_path = await spool_upload(upload, MAX_UPLOAD_BYTES)
+                files.append((upload.filename, audio_path, audio_mime_type(upload.filename, content_type)))
+
+            if not files:
+                raise ValueError("No audio files provided")
+
+            batch_id = await asyncio.to_thread(submit_batch, files, qualifiers_context)
+        except Exception:
+            # Nothing was queued for these, so nothing else will clean them up
+            for _, audio_path, _ in files:
+                audio_path.unlink(missing_ok=True)
+            raise
+        jobs = await asyncio.to_thread(get_batch_jobs, batch_id)
+        return render_batch_status(batch_id, jobs)
 
-            ext = audio.filename.lower().split('.')[-1]
-            mime_map = {'mp3': 'audio/mp3', 'wav': 'audio/wav', 'ogg': 'audio/ogg', 'm4a': 'audio/mp4'}
-            mime_type = mime_map.get(ext, content_type or 'audio/mpeg')
+    except Exception as e:
+        return Div(cls="card")(
+            Div(cls="card-body")(
+                P(f"Error: {str(e)}", cls="error-text"),
+                Button("Try Again",
+                       hx_get="/tab/process",
+                       hx_target="#tab-content",
+                       hx_swap="innerHTML")
+            )
+        )
 
-            # Upload audio to storage first
-            audio_blob_name = upload_audio(audio_bytes, audio.filename, timestamp) or ""
 
-            # Analyze audio (now returns dict with analysis and transcript)
-            result = analyze_audio(audio_bytes, mime_type, qualifiers_context)
-            result_text = result['analysis']
-            transcript_text = result['transcript']
+@rt("/batches/{batch_id}")
+def batch_status(batch_id: str):
+    """Polled by the batch progress card until every file finishes"""
+    jobs = get_batch_jobs(batch_id)
+    if not jobs:
+        return P("Batch not found", cls="error-text")
+    return render_batch_status(batch_id, jobs)
 
-        darts_score = extract_darts_score(result_text)
 
-        # Save to storage with transcript and audio URL
-        if not save_result(timestamp, source_name, result_text, transcript_text, audio_blob_name):
-            result_text += "\n\n⚠️ Failed to save to history"
+@rt("/jobs/{job_id}/stream")
+async def job_stream(job_id: str):
+    """Server-sent events: the job's stage as it changes, partial analysis markdown as Gemini writes it, then 'done'"""
+    async def events():
+        sent, sent_stage = "", None
+        while True:
+            partial = get_job_partial(job_id)
+            stage = partial['stage'] if partial else None
 
-        # Store in session for edit/reanalyze
-        sess['last_result'] = result_text
-        sess['last_filename'] = source_name
+            # Not running here (queued, finished, or another process): check the DB
+            if partial is None or partial['finished']:
+                job = await asyncio.to_thread(get_job, job_id)
+                if not job or job['status'] in ('done', 'error'):
+                    yield sse_message(render_job_done(job_id), event="done")
+                    return
+                stage = job['stage']
 
-        # Get signed URL for audio playback
-        audio_signed_url = get_audio_url(audio_blob_name) if audio_blob_name else ""
+            if stage and stage != sent_stage:
+                sent_stage = stage
+                yield sse_message(render_job_stage(stage), event="stage")
 
-        return render_results_card(result_text, source_name, timestamp, darts_score,
-                                   transcript=transcript_text, audio_url=audio_signed_url,
-                                   show_saved_toast=True)
+            if partial and partial['text'] != sent:
+                sent = partial['text']
+                yield sse_message(render_stream_partial(sent))
 
-    except Exception as e:
+            await asyncio.sleep(0.25 if partial else 1)
+
+    return EventStream(events())
+
+
+@rt("/jobs/{job_id}")
+def job_status(job_id: str, sess):
+    """Job card: progress while it runs (loaded again by the stream's 'done' event), then the results"""
+    job = get_job(job_id)
+
+    if not job:
         return Div(cls="card")(
             Div(cls="card-body")(
-                P(f"Error: {str(e)}", cls="error-text"),
+                P("Job not found", cls="error-text"),
+                Button("Try Again",
+                       hx_get="/tab/process",
+                       hx_target="#tab-content",
+                       hx_swap="innerHTML")
+            )
+        )
+
+    if job['status'] == 'error':
+        return Div(cls="card")(
+            Div(cls="card-body")(
+                P(f"Error: {job['error']}", cls="error-text"),
                 Button("Try Again",
                        hx_get="/tab/process",
                        hx_target="#tab-content",
@@ -327,6 +447,23 @@ IMPORTANT: Use these qualifiers to verify appointment qualification in Section 7
             )
         )
 
+    if job['status'] != 'done':
+        return render_job_status(job_id, job['stage'], job['filename'])
+
+    result = job['result']
+
+    # Store in session for edit/reanalyze
+    sess['last_result'] = result['result_text']
+    sess['last_filename'] = result['filename']
+
+    # Get signed URL for audio playback
+    audio_signed_url = get_audio_url(result['audio_blob']) if result['audio_blob'] else ""
+
+    return render_results_card(result['result_text'], result['filename'], result['timestamp'],
+                               result['darts_score'], transcript=result['transcript'],
+                               audio_url=audio_signed_url, show_saved_toast=result['saved'],
+                               cached=result['cached'], structured=result.get('structured'))
+
 
 @rt("/edit_form")
 def edit_form(sess):
@@ -348,22 +485,12 @@ def edit_form(sess):
 
 
 @rt("/reanalyze", methods=["POST"])
-async def reanalyze(edited_text: str, sess):
+async def reanalyze(edited_text: str):
+    """Queue the edited result for re-analysis; output streams into the job card"""
     try:
-        result_text = reanalyze_text(edited_text)
-
-        manila = pytz.timezone('Asia/Manila')
-        timestamp = datetime.now(manila).strftime("%Y-%m-%d %I:%M:%S %p PHT")
-        filename = "Re-analyzed"
-        darts_score = extract_darts_score(result_text)
-
-        if not save_result(timestamp, filename, result_text):
-            result_text += "\n\n⚠️ Failed to save to history"
-
-        sess['last_result'] = result_text
-        sess['last_filename'] = filename
-
-        return render_results_card(result_text, filename, timestamp, darts_score, show_saved_toast=True)
+        job_id = await asyncio.to_thread(submit_job, "Re-analyzed", transcript=edited_text,
+                                         kind="reanalyze")
+        return render_job_status(job_id, "Queued", "Re-analyzed")
 
     except Exception as e:
         return Div(cls="card")(
@@ -0,0 +1,105 @@
+"""
+Compare query plans and timings for the hot qa_results/jobs/cache queries
+before and after the index migrations, on a throwaway local SQLite database.
+
+    python scripts/bench_query_plans.py [rows]
+"""
+import sys
+import time
+import random
+import sqlite3
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from handlers.migrations import apply_migrations
+
+# Version of the migration that adds the hot-query indexes
+INDEX_MIGRATION = 3
+
+# (label, sql, params) as issued by handlers/database.py, jobs.py and cache.py
+HOT_QUERIES = [
+    ("history first page",
+     """SELECT id, created_at, timestamp, filename, summary, darts_score
+        FROM qa_results ORDER BY created_at DESC, id DESC LIMIT 25""", ()),
+    ("history next page",
+     """SELECT id, created_at, timestamp, filename, summary, darts_score
+        FROM qa_results WHERE (created_at, id) < (?, ?)
+        ORDER BY created_at DESC, id DESC LIMIT 25""", ("2025-06-01 00:00:00", 10**9)),
+    ("record by timestamp",
+     "SELECT full_result FROM qa_results WHERE timestamp = ?", ("2025-03-01 10:00:00 AM PHT",)),
+    ("batch jobs",
+     "SELECT id FROM jobs WHERE batch_id = ? ORDER BY created_at", ("batch-7",)),
+    ("pending jobs",
+     "SELECT id, batch_id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at", ()),
+    ("cache expiry",
+     "SELECT COUNT(*) FROM analysis_cache WHERE created_at <= ?", (1_000_000.0,)),
+    ("cache LRU order",
+     "SELECT cache_key, size_bytes FROM analysis_cache ORDER BY last_used_at ASC LIMIT 50", ()),
+]
+
+TIMING_RUNS = 50
+
+
+def populate(conn, rows: int):
+    """Fill every table with plausible synthetic rows"""
+    start = 1_700_000_000
+    conn.executemany(
+        """INSERT INTO qa_results (timestamp, filename, full_result, transcript, created_at)
+           VALUES (?, ?, ?, ?, datetime(?, 'unixepoch'))""",
+        [(f"ts-{i}", f"call_{i}.mp3", "x" * 2000, "y" * 4000, start + i * 60) for i in range(rows)]
+    )
+    conn.executemany(
+        """INSERT INTO jobs (id, status, filename, batch_id, created_at, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        [(f"job-{i}", random.choice(["done"] * 20 + ["error", "queued"]), f"call_{i}.mp3",
+          f"batch-{i // 10}", start + i, start + i) for i in range(rows)]
+    )
+    conn.executemany(
+        """INSERT INTO analysis_cache (cache_key, analysis, size_bytes, created_at, last_used_at)
+           VALUES (?, ?, ?, ?, ?)""",
+        [(f"key-{i}", "z" * 500, 500, start + i, start + random.randint(0, rows)) for i in range(rows)]
+    )
+    conn.commit()
+
+
+def measure(conn) -> list:
+    """Query plan and mean latency (ms) for each hot query"""
+    results = []
+    for label, sql, params in HOT_QUERIES:
+        plan = " | ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+        start = time.perf_counter()
+        for _ in range(TIMING_RUNS):
+            conn.execute(sql, params).fetchall()
+        ms = (time.perf_counter() - start) * 1000 / TIMING_RUNS
+        results.append((label, plan, ms))
+    return results
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    conn = sqlite3.connect(":memory:")
+
+    # Everything up to (not including) the indexes
+    apply_migrations(conn, target=INDEX_MIGRATION - 1)
+    populate(conn, rows)
+    before = measure(conn)
+
+    apply_migrations(conn, target=INDEX_MIGRATION)
+    conn.execute("ANALYZE")
+    after = measure(conn)
+
+    print(f"\n{rows} rows per table, mean of {TIMING_RUNS} runs\n")
+    full_scans = 0
+    for (label, old_plan, old_ms), (_, new_plan, new_ms) in zip(before, after):
+        print(f"{label}")
+        print(f"  before {old_ms:8.3f}ms  {old_plan}")
+        print(f"  after  {new_ms:8.3f}ms  {new_plan}")
+        if new_plan.startswith("SCAN") and "USING" not in new_plan:
+            full_scans += 1
+    print(f"\nFull table scans remaining: {full_scans}")
+    return 1 if full_scans else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Time history search through the FTS5 index against a LIKE scan over the same
+rows, on a throwaway local SQLite database. Text is mostly filler words with
+sales terms mixed in, so common queries match a large share of the calls.
+
+    python scripts/bench_search.py [rows]
+"""
+import sys
+import time
+import random
+import sqlite3
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from handlers.migrations import apply_migrations
+
+WORDS = ("budget timeline decision maker pricing demo follow up meeting renewal contract "
+         "warehouse software migration quarter invoice payroll hiring expansion vendor "
+         "security compliance integration training support onboarding").split()
+
+QUERIES = ["budget", "renewal contract", "onboard", "payroll compliance vendor"]
+
+# Same ranking query as handlers.database.search_results
+FTS_SQL = """SELECT r.timestamp
+             FROM (SELECT rowid, bm25(qa_results_fts, 10.0, 1.0, 2.0) AS score
+                   FROM qa_results_fts WHERE qa_results_fts MATCH ?
+                   ORDER BY rowid DESC LIMIT 1000) hits
+             JOIN qa_results r ON r.id = hits.rowid
+             ORDER BY hits.score LIMIT 20"""
+
+TIMING_RUNS = 5
+
+
+FILLER = [f"w{i}" for i in range(5000)]
+
+
+def sentence(count: int) -> str:
+    return " ".join(random.choice(WORDS) if random.random() < 0.1 else random.choice(FILLER)
+                    for _ in range(count))
+
+
+def populate(conn, rows: int):
+    """Plain-text rows (LIKE can't see inside compressed ones, so this favors the scan)"""
+    batch = []
+    for i in range(rows):
+        batch.append((i + 1, f"ts-{i}", f"call_{i}.mp3", sentence(60), sentence(200)))
+        if len(batch) == 5000 or i == rows - 1:
+            conn.executemany(
+                "INSERT INTO qa_results (id, timestamp, filename, full_result, transcript) VALUES (?, ?, ?, ?, ?)",
+                [row[:5] for row in batch]
+            )
+            conn.executemany(
+                "INSERT INTO qa_results_fts (rowid, filename, full_result, transcript) VALUES (?, ?, ?, ?)",
+                [(row[0], row[2], row[3], row[4]) for row in batch]
+            )
+            batch = []
+    conn.commit()
+
+
+def timed(conn, sql: str, params: tuple) -> float:
+    """Mean milliseconds for one query"""
+    start = time.perf_counter()
+    for _ in range(TIMING_RUNS):
+        conn.execute(sql, params).fetchall()
+    return (time.perf_counter() - start) * 1000 / TIMING_RUNS
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    conn = sqlite3.connect(":memory:")
+    apply_migrations(conn)
+
+    start = time.perf_counter()
+    populate(conn, rows)
+    print(f"\nIndexed {rows} rows in {time.perf_counter() - start:.1f}s, mean of {TIMING_RUNS} runs\n")
+
+    slowest = 0.0
+    for query in QUERIES:
+        terms = query.split()
+        match_query = " ".join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+        fts_ms = timed(conn, FTS_SQL, (match_query.strip(),))
+
+        # Without an index every match has to be found before any ranking
+        like_sql = ("SELECT timestamp FROM qa_results WHERE "
+                    + " AND ".join("(filename LIKE ? OR full_result LIKE ? OR transcript LIKE ?)" for _ in terms))
+        like_ms = timed(conn, like_sql, tuple(f"%{term}%" for term in terms for _ in range(3)))
+
+        slowest = max(slowest, fts_ms)
+        print(f"{query!r:32} fts {fts_ms:8.2f}ms   like {like_ms:8.2f}ms")
+
+    print(f"\nSlowest FTS query: {slowest:.2f}ms")
+    return 0 if slowest < 50 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Peak resident memory for taking in one upload: reading the whole request body
+(the old path) against spooling it to disk in chunks. Each mode runs in its own
+process so the peaks don't mix.
+
+    python scripts/bench_upload_memory.py [megabytes]
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+MODES = ("buffered", "spooled")
+
+
+class FileUpload:
+    """Just enough of Starlette's UploadFile, reading from a file on disk"""
+
+    def __init__(self, path: Path):
+        self.filename = path.name
+        self.file = open(path, 'rb')
+
+    async def read(self, size: int = -1) -> bytes:
+        return self.file.read(size)
+
+
+async def take_upload(mode: str, source: Path) -> Path:
+    from handlers.jobs import JOB_INPUT_DIR, spool_upload
+
+    upload = FileUpload(source)
+    if mode == "spooled":
+        return await spool_upload(upload, max_bytes=source.stat().st_size)
+    # What process_call did before: the whole body in memory, then on to disk
+    data = await upload.read()
+    path = JOB_INPUT_DIR / f"bench-{os.getpid()}"
+    path.write_bytes(data)
+    return path
+
+
+def child(mode: str, source: Path):
+    """Print resident MB before and peak MB after one upload"""
+    from handlers.jobs import _memory_mb
+
+    before = _memory_mb()['rss_mb']
+    path = asyncio.run(take_upload(mode, source))
+    peak = _memory_mb()['peak_rss_mb']
+    path.unlink(missing_ok=True)
+    print(before, peak)
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "call.mp3"
+        with open(source, 'wb') as out:
+            for _ in range(megabytes):
+                out.write(os.urandom(1_000_000))
+
+        print(f"\n{megabytes}MB upload\n")
+        growth = {}
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", mode, str(source)],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            before, peak = float(output[-2]), float(output[-1])
+            growth[mode] = peak - before
+            print(f"{mode:10} rss before {before:8.1f}MB   peak {peak:8.1f}MB   growth {growth[mode]:8.1f}MB")
+
+    print(f"\nSpooling used {growth['buffered'] - growth['spooled']:.1f}MB less at peak")
+    # Bounded means independent of upload size: a few chunks, not the whole file
+    return 0 if growth['spooled'] < megabytes / 4 else 1
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        child(sys.argv[2], Path(sys.argv[3]))
+    else:
+        sys.exit(main())
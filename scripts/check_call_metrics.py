@@ -0,0 +1,47 @@
+"""
+Check that extract_call_metrics reads the scorecard format the app produces
+(the mock analysis mirrors it), plus the variants Gemini writes for the same
+lines. Exits non-zero on any mismatch.
+
+    python scripts/check_call_metrics.py
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from handlers.gemini import extract_call_metrics, _mock_analysis
+
+MOCK = _mock_analysis("Audio file")
+
+# (label, analysis text, expected subset of the metrics)
+CASES = [
+    ("mock analysis", MOCK,
+     {'desire': 1, 'authority': 2, 'revenue': 2, 'timeliness': 2, 'size': 1, 'total': 8,
+      'objections': 2, 'meeting_confirmed': True}),
+    ("meeting not confirmed", MOCK.replace("Meeting Date & Time Confirmed: Done ✓",
+                                           "Meeting Date & Time Confirmed: Not Done ✗"),
+     {'meeting_confirmed': False}),
+    ("bold labels", MOCK.replace("- Meeting Date & Time Confirmed: Done ✓",
+                                 "- **Meeting Date & Time Confirmed:** ✓"),
+     {'meeting_confirmed': True}),
+    ("no objections", MOCK.replace("Count number of objections: 2 objections",
+                                   "Count number of objections: None"),
+     {'objections': 0}),
+    ("nothing stated", "## 1. INTRODUCTION\n- RLM Stated: Done ✓",
+     {'total': None, 'objections': None, 'meeting_confirmed': None}),
+]
+
+
+def main():
+    failures = 0
+    for label, text, expected in CASES:
+        metrics = extract_call_metrics(text)
+        wrong = {key: (metrics[key], value) for key, value in expected.items() if metrics[key] != value}
+        print(f"{'ok  ' if not wrong else 'FAIL'} {label}" + (f"  got/expected {wrong}" if wrong else ""))
+        failures += bool(wrong)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+One-time move of audio stored under the old per-upload names (uuid_filename or
+timestamp_filename) to content-addressed names, so recordings uploaded more than
+once share one blob. Each blob is hashed, stored under its content name (skipped
+if that already exists), its records are repointed, and the old blob is deleted
+once no record references it.
+
+Uses the same Turso database and storage (GCS or .mock_audio) as the app. Run it
+while the app is stopped: a running app may briefly keep serving old names from
+its record cache.
+
+    python scripts/dedup_audio_blobs.py [--dry-run]
+"""
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from handlers.database import connection
+from handlers.storage import (
+    GCS_BUCKET_NAME, get_storage_client, get_mock_audio_path, content_blob_name, sha256_file, upload_audio
+)
+
+CONTENT_NAME = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]+)?$")
+
+
+def legacy_blobs(conn) -> list:
+    """Referenced blobs that aren't content-addressed yet"""
+    rows = conn.execute(
+        "SELECT blob_name FROM audio_blobs WHERE refcount > 0 ORDER BY blob_name"
+    ).fetchall()
+    return [name for (name,) in rows if not CONTENT_NAME.match(name)]
+
+
+def fetch(blob_name: str, tmp: Path) -> Path | None:
+    """Local path holding the blob's bytes (downloaded from GCS when needed)"""
+    client = get_storage_client()
+    if client is None:
+        return get_mock_audio_path(blob_name)
+    blob = client.bucket(GCS_BUCKET_NAME).blob(blob_name)
+    if not blob.exists():
+        return None
+    path = tmp / "download"
+    blob.download_to_filename(str(path))
+    return path
+
+
+def delete(blob_name: str):
+    client = get_storage_client()
+    if client is None:
+        path = get_mock_audio_path(blob_name)
+        if path:
+            path.unlink()
+    else:
+        client.bucket(GCS_BUCKET_NAME).blob(blob_name).delete()
+
+
+def main():
+    dry_run = "--dry-run" in sys.argv[1:]
+
+    with connection() as conn:
+        names = legacy_blobs(conn)
+    print(f"\n{len(names)} blob(s) under legacy names{' (dry run)' if dry_run else ''}\n")
+
+    sizes = {}  # content name -> bytes
+    scanned_bytes = missing = deleted = 0
+    for blob_name in names:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = fetch(blob_name, Path(tmp))
+            if path is None:
+                missing += 1
+                print(f"[WARN] {blob_name} is referenced but not in storage, left as is")
+                continue
+            size = path.stat().st_size
+            scanned_bytes += size
+            digest = sha256_file(path)
+            new_name = content_blob_name(digest, blob_name)
+            sizes[new_name] = size
+            if dry_run:
+                print(f"{blob_name} -> {new_name}")
+                continue
+            if upload_audio(path, blob_name, digest) != new_name:
+                print(f"[ERROR] Could not store {blob_name} as {new_name}, left as is")
+                continue
+
+        # The audio_blobs triggers move the references over
+        with connection() as conn:
+            conn.execute("UPDATE qa_results SET audio_url = ? WHERE audio_url = ?", (new_name, blob_name))
+            conn.execute("UPDATE qa_results SET original_audio_url = ? WHERE original_audio_url = ?",
+                         (new_name, blob_name))
+            conn.commit()
+            refcount = conn.execute(
+                "SELECT refcount FROM audio_blobs WHERE blob_name = ?", (blob_name,)
+            ).fetchone()[0]
+            if refcount <= 0:
+                delete(blob_name)
+                conn.execute("DELETE FROM audio_blobs WHERE blob_name = ?", (blob_name,))
+                conn.commit()
+                deleted += 1
+        print(f"{blob_name} -> {new_name}")
+
+    kept_bytes = sum(sizes.values())
+    print(f"\n{len(names) - missing} blob(s), {scanned_bytes / 1e6:.1f}MB -> "
+          f"{len(sizes)} unique, {kept_bytes / 1e6:.1f}MB "
+          f"({(scanned_bytes - kept_bytes) / 1e6:.1f}MB {'reclaimable' if dry_run else 'reclaimed'})")
+    if not dry_run:
+        print(f"Deleted {deleted} legacy blob(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())